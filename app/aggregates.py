@@ -0,0 +1,179 @@
+# app/aggregates.py
+
+"""
+Sales aggregates: per-user order totals, per-product sales and daily revenue.
+
+The tables are updated incrementally in the transaction that creates an order (see
+`record_order`), so they are always consistent with the orders table and dashboards
+read them instead of aggregating `orders` and `order_items`. Revenue comes from
+`price_at_purchase` and cost from the products' `buying_price`, giving the margin.
+
+`python -m app.aggregates` rebuilds all of them from the order history (after the
+migration that creates them, or to repair drift).
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import Date, cast, delete, exists, func, insert, literal_column, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+from .config import env_int
+
+# Rows each day's revenue is spread over, so concurrent orders do not queue on one row.
+# Can be changed at any time: readers add up whatever buckets exist.
+DAILY_REVENUE_BUCKETS = env_int("DAILY_REVENUE_BUCKETS", 8)
+
+AGGREGATE_MODELS = (models.UserOrderStats, models.ProductSalesStats, models.DailyRevenue)
+
+
+def _increment(dialect_name: str, model, rows: List[dict], counters: Sequence[str], latest: Sequence[str] = ()):
+    """
+    Multi-row `INSERT ... ON CONFLICT (primary key) DO UPDATE` that adds `counters` to
+    the existing row (or creates it) and overwrites the `latest` columns.
+    """
+    insert_ = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert_(model).values(rows)
+    updates = {name: getattr(model, name) + stmt.excluded[name] for name in counters}
+    updates.update({name: stmt.excluded[name] for name in latest})
+    return stmt.on_conflict_do_update(index_elements=list(model.__table__.primary_key.columns), set_=updates)
+
+
+def _utc_date(value: datetime):
+    # SQLite returns naive datetimes, which are already in UTC (CURRENT_TIMESTAMP)
+    return (value.astimezone(timezone.utc) if value.tzinfo else value).date()
+
+
+async def record_order(
+    db: AsyncSession, order: models.Order, items: Iterable[models.OrderItem], buying_prices: Dict[int, float],
+    sales_buckets: Optional[Dict[int, int]] = None,
+) -> None:
+    """
+    Adds a new order to the aggregates, inside the caller's transaction (three statements).
+    `buying_prices` maps the ordered product ids to their current buying price, and
+    `sales_buckets` the ones with inventory shards to their shard count: their sales
+    row is picked by order id among that many buckets.
+    Product rows are upserted in ascending id order, the same order `crud` locks the
+    products in, so concurrent orders cannot deadlock on them.
+    """
+    dialect_name = db.get_bind().dialect.name
+    created_at = order.created_at or datetime.now(timezone.utc)
+    sales_buckets = sales_buckets or {}
+
+    products: Dict[int, dict] = {}
+    for item in items:
+        buckets = sales_buckets.get(item.product_id)
+        row = products.setdefault(item.product_id, {
+            "product_id": item.product_id, "bucket": order.id % buckets if buckets else 0, "units_sold": 0, "order_count": 1, "revenue": 0.0, "cost": 0.0, "last_sold_at": created_at,
+        })
+        row["units_sold"] += item.quantity
+        row["revenue"] += item.quantity * item.price_at_purchase
+        row["cost"] += item.quantity * buying_prices[item.product_id]
+
+    await db.execute(_increment(
+        dialect_name, models.UserOrderStats,
+        [{"user_id": order.buyer_id, "order_count": 1, "total_spent": order.total_amount, "first_order_at": created_at, "last_order_at": created_at}],
+        counters=("order_count", "total_spent"), latest=("last_order_at",),
+    ))
+    if products:
+        await db.execute(_increment(
+            dialect_name, models.ProductSalesStats, [products[product_id] for product_id in sorted(products)],
+            counters=("units_sold", "order_count", "revenue", "cost"), latest=("last_sold_at",),
+        ))
+    await db.execute(_increment(
+        dialect_name, models.DailyRevenue,
+        [{
+            "day": _utc_date(created_at),
+            "bucket": order.id % DAILY_REVENUE_BUCKETS,
+            "order_count": 1,
+            "units_sold": sum(row["units_sold"] for row in products.values()),
+            "revenue": sum(row["revenue"] for row in products.values()),
+            "cost": sum(row["cost"] for row in products.values()),
+        }],
+        counters=("order_count", "units_sold", "revenue", "cost"),
+    ))
+
+
+def _utc_day(dialect_name: str, column):
+    """SQL expression for the UTC date of a timestamp column."""
+    if dialect_name == "postgresql":
+        return cast(func.timezone(literal_column("'UTC'"), column), Date)
+    return func.date(column)
+
+
+def _processed(order_id):
+    """
+    Whether an order counts: orders accepted in queued intake mode are recorded by the
+    worker once their job is done, and never if it is dead.
+    """
+    return ~exists().where(models.OrderJob.order_id == order_id, models.OrderJob.state != "done")
+
+
+async def rebuild(db: AsyncSession) -> Dict[str, int]:
+    """
+    Recomputes every aggregate from the orders and commits. Returns the rows written per table.
+    On PostgreSQL the aggregate tables are locked first: orders being created meanwhile
+    wait at their aggregate update and are applied on top of the rebuilt totals, so
+    none is counted twice or lost. Checkouts therefore stall while this runs.
+    Cost uses the products' current buying price, which order items do not record.
+    """
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        tables = ", ".join(model.__tablename__ for model in AGGREGATE_MODELS)
+        await db.execute(text(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE"))
+    for model in AGGREGATE_MODELS:
+        await db.execute(delete(model))
+
+    Order, OrderItem, Product = models.Order, models.OrderItem, models.Product
+    revenue = func.sum(OrderItem.quantity * OrderItem.price_at_purchase)
+    cost = func.sum(OrderItem.quantity * Product.buying_price)
+    sources = {
+        models.UserOrderStats: select(
+            Order.buyer_id, func.count(Order.id), func.sum(Order.total_amount), func.min(Order.created_at), func.max(Order.created_at)
+        ).where(_processed(Order.id)).group_by(Order.buyer_id),
+        # Rebuilt sales all go to bucket 0; new orders spread out again from there.
+        # `last_sold_at` is the order's creation time, as `record_order` writes it
+        models.ProductSalesStats: select(
+            OrderItem.product_id, literal_column("0"), func.sum(OrderItem.quantity), func.count(OrderItem.order_id.distinct()), revenue, cost, func.max(Order.created_at)
+        )
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .where(_processed(OrderItem.order_id))
+        .group_by(OrderItem.product_id),
+    }
+    # The bucket count is inlined so GROUP BY repeats the exact select expression
+    day = _utc_day(dialect_name, Order.created_at)
+    bucket = Order.id % literal_column(str(int(DAILY_REVENUE_BUCKETS)))
+    sources[models.DailyRevenue] = (
+        select(
+            day, bucket, func.count(Order.id.distinct()), func.coalesce(func.sum(OrderItem.quantity), 0),
+            func.coalesce(revenue, 0.0), func.coalesce(cost, 0.0),
+        )
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+        .where(_processed(Order.id))
+        .group_by(day, bucket)
+    )
+
+    written = {}
+    for model, source in sources.items():
+        columns = [column.key for column in model.__table__.columns]
+        result = await db.execute(insert(model).from_select(columns, source))
+        written[model.__tablename__] = result.rowcount
+    await db.commit()
+    return written
+
+
+async def main() -> None:
+    async with database.AsyncSessionLocal() as db:
+        written = await rebuild(db)
+    for table, rows in written.items():
+        print(f"Rebuilt {table}: {rows} rows.")
+    await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
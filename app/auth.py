@@ -1,37 +1,68 @@
 # app/auth.py
 
+import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import schemas, models
+from .cache import TTLCache
+from .config import env_float, env_int
 from .database import get_db
+from .passwords import password_hasher
 
 # Configuration for JWT
 SECRET_KEY = "your-super-secret-key" # In a real app, use environment variables!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authentication mode.
+# "stateless": tokens carry the user id, and the user record is served from an
+#   in-process cache, so authenticated requests do not hit the database on a cache
+#   hit. The active and admin checks use that record rather than token claims, so
+#   deactivating or demoting a user takes effect within the cache TTL instead of
+#   when the token expires.
+# "database": the user is looked up by email on every request.
+AUTH_MODE = os.getenv("AUTH_MODE", "stateless")
+
+# Cache of authenticated users for the stateless mode, keyed by user id.
+# crud.update_user and crud.delete_user invalidate entries; the TTL bounds staleness
+# across worker processes.
+user_cache = TTLCache(
+    maxsize=env_int("USER_CACHE_MAX_SIZE", 10000),
+    ttl=env_float("USER_CACHE_TTL_SECONDS", 60.0),
+)
 
 # OAuth2PasswordBearer for token extraction from headers
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/token")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifies a plain password against a hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """Hashes a plain password."""
-    return pwd_context.hash(password)
+    return await password_hasher.hash(password)
+
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[models.User]:
+    """
+    Checks an email/password pair and returns the user, or None if they do not match.
+    If the stored hash uses an outdated scheme or cost factor, it is replaced with a
+    fresh hash of the same password.
+    """
+    user = await db.scalar(select(models.User).where(models.User.email == email))
+    if user is None:
+        return None
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Creates a JWT access token."""
@@ -44,9 +75,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+def create_user_access_token(user: models.User, expires_delta: Optional[timedelta] = None) -> str:
+    """Creates a JWT access token carrying the user's email and id."""
+    return create_access_token(data={"sub": user.email, "uid": user.id}, expires_delta=expires_delta)
+
+def invalidate_cached_user(user_id: int) -> None:
+    """Drops a user from the authentication cache after it was changed or deleted."""
+    user_cache.invalidate(user_id)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> schemas.UserResponse:
     """
     Dependency to get the current authenticated user from the JWT token.
+    In stateless mode the user is resolved by the token's `uid` claim and served from
+    the user cache, so a cache hit costs no SQL. Tokens without the claim (issued
+    before it was added) fall back to the lookup by email.
     Raises HTTPException if the token is invalid or the user is not found.
     """
     credentials_exception = HTTPException(
@@ -59,16 +101,27 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = schemas.TokenData(email=email)
+        token_data = schemas.TokenData(email=email, user_id=payload.get("uid"))
     except JWTError:
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+    stateless = AUTH_MODE == "stateless" and token_data.user_id is not None
+    if stateless:
+        cached_user = user_cache.get(token_data.user_id)
+        if cached_user is not None:
+            return cached_user
+        user = await db.get(models.User, token_data.user_id)
+    else:
+        user = await db.scalar(select(models.User).where(models.User.email == token_data.email))
     if user is None:
         raise credentials_exception
-    return user
 
-def get_current_active_user(current_user: models.User = Depends(get_current_user)) -> models.User:
+    current_user = schemas.UserResponse.model_validate(user)
+    if stateless:
+        user_cache.set(current_user.id, current_user)
+    return current_user
+
+async def get_current_active_user(current_user: schemas.UserResponse = Depends(get_current_user)) -> schemas.UserResponse:
     """
     Dependency to get the current active authenticated user.
     Raises HTTPException if the user is inactive.
@@ -77,7 +130,7 @@ def get_current_active_user(current_user: models.User = Depends(get_current_user
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
     return current_user
 
-def get_current_admin_user(current_user: models.User = Depends(get_current_active_user)) -> models.User:
+async def get_current_admin_user(current_user: schemas.UserResponse = Depends(get_current_active_user)) -> schemas.UserResponse:
     """
     Dependency to get the current authenticated user with admin privileges.
     Raises HTTPException if the user is not an admin.
@@ -85,4 +138,3 @@ def get_current_admin_user(current_user: models.User = Depends(get_current_activ
     if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not an admin user")
     return current_user
-
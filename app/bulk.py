@@ -0,0 +1,294 @@
+# app/bulk.py
+
+import codecs
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import Select, case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models, schemas
+from .catalog import invalidate_cached_product
+from .config import env_int
+from .queries.orders import ORDER_COLUMNS, ORDER_ITEM_COLUMNS, ORDER_SORT_KEY
+from .queries.products import PRODUCT_COLUMNS
+
+# Rows validated and written per INSERT ... ON CONFLICT statement (and transaction)
+PRODUCT_IMPORT_CHUNK_SIZE = env_int("PRODUCT_IMPORT_CHUNK_SIZE", 1000)
+
+# Per-row errors returned in the import result; further failures are only counted
+PRODUCT_IMPORT_MAX_ERRORS = env_int("PRODUCT_IMPORT_MAX_ERRORS", 1000)
+
+# Rows fetched per round trip from the server-side cursor while exporting
+PRODUCT_EXPORT_BATCH_SIZE = env_int("PRODUCT_EXPORT_BATCH_SIZE", 1000)
+ORDER_EXPORT_BATCH_SIZE = env_int("ORDER_EXPORT_BATCH_SIZE", 5000) # Order item rows
+
+# Columns written by an import; on a SKU conflict all of them except the SKU are updated
+IMPORT_FIELDS = tuple(schemas.ProductCreate.model_fields)
+
+CSV_MEDIA_TYPE = "text/csv"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+# --- Import ---
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decodes a UTF-8 byte stream into lines (split on LF, endings kept) as it arrives."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        # The last piece may be an incomplete line; keep it for the next chunk
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def _csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Yields (line number, row) for every data row of a CSV stream with a header row.
+    A quoted field may span lines, so lines are joined until their quotes balance.
+    Empty cells are treated as missing values.
+    """
+    header: Optional[List[str]] = None
+    record, start_line, line_number = "", 0, 0
+    async for line in _lines(chunks):
+        line_number += 1
+        if not record:
+            start_line = line_number
+        record += line
+        if record.count('"') % 2:
+            continue # Inside a quoted field
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield start_line, {name: value for name, value in zip(header, values) if value != ""}
+    if record:
+        yield start_line, {"": record} # Unterminated quote; reported as an invalid row
+
+
+async def _ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yields (line number, decoded value) for every non-blank line of an NDJSON stream."""
+    line_number = 0
+    async for line in _lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            yield line_number, orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield line_number, e
+
+
+def _validation_messages(error: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(part) for part in err['loc']) or 'row'}: {err['msg']}"
+        for err in error.errors(include_url=False)
+    ]
+
+
+def _upsert_statement(dialect_name: str):
+    """
+    Multi-row INSERT that updates the existing product when the SKU is already taken.
+    Rows without a SKU never conflict (NULLs are distinct), so they are always inserted.
+    The stock of products with inventory shards is kept: their shards hold it, and
+    it is set through the product update endpoint instead.
+    """
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(models.Product)
+    updates = {name: stmt.excluded[name] for name in IMPORT_FIELDS if name != "sku"}
+    updates["quantity"] = case((models.Product.stock_shards > 0, models.Product.quantity), else_=stmt.excluded.quantity)
+    updates["updated_at"] = func.now()
+    return stmt.on_conflict_do_update(index_elements=[models.Product.sku], set_=updates).returning(
+        models.Product.id
+    )
+
+
+class ProductImporter:
+    """
+    Loads a stream of product records in chunks: each chunk is validated against
+    `ProductCreate` and written with one `INSERT ... ON CONFLICT (sku) DO UPDATE`
+    statement in its own transaction. Invalid rows are reported and skipped; if the
+    database rejects a chunk, its rows are retried one by one so only the offending
+    rows fail.
+    """
+    def __init__(self, db: AsyncSession, chunk_size: int = PRODUCT_IMPORT_CHUNK_SIZE):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.result = schemas.ProductImportResult(processed=0, imported=0, failed=0)
+        self._stmt = _upsert_statement(db.get_bind().dialect.name)
+
+    def _fail(self, line: int, messages: List[str]) -> None:
+        self.result.failed += 1
+        if len(self.result.errors) < PRODUCT_IMPORT_MAX_ERRORS:
+            self.result.errors.append(schemas.ProductImportError(line=line, errors=messages))
+
+    async def run(self, records: AsyncIterator[Tuple[int, object]]) -> schemas.ProductImportResult:
+        chunk: List[Tuple[int, dict]] = []
+        async for line, record in records:
+            self.result.processed += 1
+            if isinstance(record, Exception):
+                self._fail(line, [f"row: invalid JSON ({record})"])
+                continue
+            try:
+                product = schemas.ProductCreate.model_validate(record)
+            except ValidationError as e:
+                self._fail(line, _validation_messages(e))
+                continue
+            chunk.append((line, product.model_dump()))
+            if len(chunk) >= self.chunk_size:
+                await self._write(chunk)
+                chunk = []
+        if chunk:
+            await self._write(chunk)
+        return self.result
+
+    async def _write(self, chunk: List[Tuple[int, dict]]) -> None:
+        # One statement cannot update the same row twice: the last row for a SKU wins
+        latest: Dict[str, int] = {}
+        for line, values in chunk:
+            if values["sku"] is not None:
+                if values["sku"] in latest:
+                    self._fail(latest[values["sku"]], [f"sku: '{values['sku']}' appears again on line {line}"])
+                latest[values["sku"]] = line
+        rows = [(line, values) for line, values in chunk if values["sku"] is None or latest[values["sku"]] == line]
+        try:
+            await self._execute([values for _, values in rows])
+        except DBAPIError:
+            await self.db.rollback()
+            for line, values in rows:
+                try:
+                    await self._execute([values])
+                except DBAPIError as e:
+                    await self.db.rollback()
+                    self._fail(line, [f"row: rejected by the database ({e.orig})"])
+
+    async def _execute(self, rows: List[dict]) -> None:
+        product_ids = (await self.db.scalars(self._stmt, rows)).all()
+        await self.db.commit()
+        self.result.imported += len(product_ids)
+        # Updated products may be cached with their old values
+        for product_id in product_ids:
+            invalidate_cached_product(product_id)
+
+
+async def import_products(db: AsyncSession, chunks: AsyncIterator[bytes], media_type: str) -> schemas.ProductImportResult:
+    """Imports products from a CSV (with a header row) or NDJSON byte stream."""
+    records = _ndjson_records(chunks) if media_type == NDJSON_MEDIA_TYPE else _csv_records(chunks)
+    return await ProductImporter(db).run(records)
+
+
+# --- Export ---
+
+def _ndjson_line(values: dict) -> bytes:
+    return orjson.dumps(values, option=orjson.OPT_UTC_Z | orjson.OPT_APPEND_NEWLINE)
+
+
+def _csv_lines(rows) -> bytes:
+    """Encodes a batch of rows as CSV lines (datetimes in ISO 8601)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow([value.isoformat() if hasattr(value, "isoformat") else value for value in row])
+    return buffer.getvalue().encode("utf-8")
+
+
+async def _stream_partitions(stmt: Select, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+    """
+    Yields the rows of `stmt` in batches fetched from a server-side cursor.
+    The next batch is only fetched once the previous one has been consumed, and the
+    response is only asked for the next chunk once the client has accepted the previous
+    one, so a slow client slows the cursor down instead of buffering rows in memory.
+    The generator owns its session (on a read replica when available): it runs while
+    the response is sent, after the request's dependencies have been closed.
+    """
+    async with database.read_session() as db:
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            yield partition
+
+
+async def export_products(media_type: str) -> AsyncIterator[bytes]:
+    """Streams the whole catalog, ordered by ID, as CSV or NDJSON (one batch per chunk)."""
+    stmt = select(*PRODUCT_COLUMNS).order_by(models.Product.id)
+    keys = tuple(stmt.selected_columns.keys())
+    if media_type == CSV_MEDIA_TYPE:
+        yield _csv_lines([keys])
+    async for partition in _stream_partitions(stmt, PRODUCT_EXPORT_BATCH_SIZE):
+        if media_type == CSV_MEDIA_TYPE:
+            yield _csv_lines(partition)
+        else:
+            yield b"".join(_ndjson_line(dict(zip(keys, row))) for row in partition)
+
+
+# Item columns of an order export, prefixed to keep them apart from the order's own
+ORDER_EXPORT_ITEM_COLUMNS = tuple(column.label(f"item_{column.key}") for column in ORDER_ITEM_COLUMNS)
+
+
+def order_export_statement(
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> Select:
+    """
+    Orders joined with their items, oldest first, optionally restricted to a status
+    and a `[created_from, created_to)` range. The filters and the sort are served by
+    the `(status, created_at)` and `(created_at, id)` order indexes (scanned backwards);
+    items are found through `ix_order_items_order_id`.
+    """
+    stmt = select(*ORDER_COLUMNS, *ORDER_EXPORT_ITEM_COLUMNS).outerjoin(
+        models.OrderItem, models.OrderItem.order_id == models.Order.id
+    )
+    if status is not None:
+        stmt = stmt.where(models.Order.status == status)
+    if created_from is not None:
+        stmt = stmt.where(models.Order.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(models.Order.created_at < created_to)
+    return stmt.order_by(*ORDER_SORT_KEY, models.OrderItem.id)
+
+
+async def export_orders(media_type: str, stmt: Select) -> AsyncIterator[bytes]:
+    """
+    Streams the rows of `order_export_statement` as CSV (one line per order item,
+    order columns repeated) or NDJSON (one `OrderResponse` object per order).
+    An order's items are adjacent in the result, so NDJSON lines are assembled on the
+    fly; only the order in progress is kept between batches.
+    """
+    if media_type == CSV_MEDIA_TYPE:
+        yield _csv_lines([stmt.selected_columns.keys()])
+        async for partition in _stream_partitions(stmt, ORDER_EXPORT_BATCH_SIZE):
+            yield _csv_lines(partition)
+        return
+
+    order_keys = [column.key for column in ORDER_COLUMNS]
+    item_keys = [column.key for column in ORDER_ITEM_COLUMNS]
+    split = len(order_keys)
+    order_id_index, item_id_index = order_keys.index("id"), split + item_keys.index("id")
+    current: Optional[dict] = None
+    async for partition in _stream_partitions(stmt, ORDER_EXPORT_BATCH_SIZE):
+        lines = []
+        for row in partition:
+            if current is None or row[order_id_index] != current["id"]:
+                if current is not None:
+                    lines.append(_ndjson_line(current))
+                current = dict(zip(order_keys, row[:split]), items=[])
+            if row[item_id_index] is not None: # Absent for orders without items
+                current["items"].append(dict(zip(item_keys, row[split:])))
+        if lines:
+            yield b"".join(lines)
+    if current is not None:
+        yield _ndjson_line(current)
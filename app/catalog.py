@@ -0,0 +1,78 @@
+# app/catalog.py
+
+import hashlib
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .cache import TTLCache
+from .config import env_float, env_int
+from .metrics.prometheus_exporter import PRODUCT_CACHE_REQUESTS_TOTAL
+from .queries import products as product_queries
+from .serialization import dump_json
+
+# How long a product payload is served from memory before it is re-read.
+# Writes through crud refresh the entry immediately in the process that made them;
+# the TTL bounds staleness in the other worker processes.
+PRODUCT_CACHE_TTL_SECONDS = env_float("PRODUCT_CACHE_TTL_SECONDS", 30.0)
+PRODUCT_CACHE_MAX_SIZE = env_int("PRODUCT_CACHE_MAX_SIZE", 50000)
+
+# max-age advertised to clients and CDNs in Cache-Control for product reads
+PRODUCT_CACHE_MAX_AGE = env_int("PRODUCT_CACHE_MAX_AGE", 30)
+
+
+@dataclass(frozen=True)
+class CachedProduct:
+    """A serialized `ProductResponse` together with its ETag."""
+    body: bytes
+    etag: str
+
+
+product_cache = TTLCache(maxsize=PRODUCT_CACHE_MAX_SIZE, ttl=PRODUCT_CACHE_TTL_SECONDS)
+
+
+def cache_product(product: Union[models.Product, Row]) -> CachedProduct:
+    """
+    Serializes a product (an ORM object after a write, or a `ProductResponse` row after
+    a read) once and stores the payload in the cache (write-through).
+    """
+    body = dump_json(schemas.ProductResponse, product)
+    entry = CachedProduct(body=body, etag=f'"{hashlib.sha1(body).hexdigest()}"')
+    product_cache.set(product.id, entry)
+    return entry
+
+
+def invalidate_cached_product(product_id: int) -> None:
+    """
+    Drops a product's cached payload; called whenever the product or its stock changes
+    (updates, deletion, orders, reservations, bulk imports, shard reconciliation).
+    """
+    product_cache.invalidate(product_id)
+
+
+async def get_cached_product(db: AsyncSession, product_id: int) -> Optional[CachedProduct]:
+    """
+    Returns the cached payload for a product, loading it from the database on a miss.
+    Returns None if the product does not exist.
+    """
+    entry = product_cache.get(product_id)
+    if entry is not None:
+        PRODUCT_CACHE_REQUESTS_TOTAL.labels(result="hit").inc()
+        return entry
+    PRODUCT_CACHE_REQUESTS_TOTAL.labels(result="miss").inc()
+    product = await product_queries.get_product(db, product_id)
+    if product is None:
+        return None
+    return cache_product(product)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluates an `If-None-Match` header (a list of ETags, or "*") against `etag`."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison: W/"x" matches "x"
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
@@ -0,0 +1,138 @@
+# app/config.py
+
+import os
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+from uuid import uuid4
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Reads a boolean flag from the environment ("1", "true", "yes", "on" are truthy)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    """Reads an integer setting from the environment."""
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    """Reads a float setting from the environment."""
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def async_database_url(url: str) -> str:
+    """
+    Normalizes a PostgreSQL URL to use the asyncpg driver.
+    Plain `postgresql://` URLs (as used by docker-compose and most tooling) are
+    rewritten to `postgresql+asyncpg://`; URLs that already name a driver are kept.
+    """
+    for prefix in ("postgresql://", "postgres://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    """
+    Engine and connection pool configuration, read from the environment.
+
+    - DATABASE_URL: connection URL (plain `postgresql://` URLs are switched to asyncpg).
+    - DATABASE_REPLICA_URLS: comma-separated read replica URLs (same pool settings).
+    - DB_POOL_SIZE / DB_MAX_OVERFLOW: persistent and burst connections per process.
+    - DB_POOL_TIMEOUT: seconds to wait for a free connection before failing.
+    - DB_POOL_RECYCLE: seconds after which a connection is replaced (-1 disables).
+    - DB_POOL_PRE_PING: test connections on checkout to survive server restarts.
+    - DB_STATEMENT_TIMEOUT_MS: server-side statement timeout (0 disables).
+    - DB_ECHO: log every SQL statement (development only, it is expensive).
+    - DB_PGBOUNCER: run behind PgBouncer in transaction pooling mode.
+    - DB_DISABLE_POOL: use NullPool and leave pooling to PgBouncer entirely.
+    """
+    url: str = "postgresql+asyncpg://user:password@db/ecommerce"
+    replica_urls: Tuple[str, ...] = ()
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_timeout_ms: int = 0
+    echo: bool = False
+    pgbouncer: bool = False
+    disable_pool: bool = False
+
+    @classmethod
+    def from_env(cls, url: Optional[str] = None) -> "DatabaseSettings":
+        """Builds the settings from environment variables, falling back to the defaults."""
+        return cls(
+            url=async_database_url(url or os.getenv("DATABASE_URL", cls.url)),
+            replica_urls=tuple(
+                async_database_url(replica_url.strip())
+                for replica_url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+                if replica_url.strip()
+            ),
+            pool_size=env_int("DB_POOL_SIZE", cls.pool_size),
+            max_overflow=env_int("DB_MAX_OVERFLOW", cls.max_overflow),
+            pool_timeout=env_float("DB_POOL_TIMEOUT", cls.pool_timeout),
+            pool_recycle=env_int("DB_POOL_RECYCLE", cls.pool_recycle),
+            pool_pre_ping=env_bool("DB_POOL_PRE_PING", cls.pool_pre_ping),
+            statement_timeout_ms=env_int("DB_STATEMENT_TIMEOUT_MS", cls.statement_timeout_ms),
+            echo=env_bool("DB_ECHO", cls.echo),
+            pgbouncer=env_bool("DB_PGBOUNCER", cls.pgbouncer),
+            disable_pool=env_bool("DB_DISABLE_POOL", cls.disable_pool),
+        )
+
+    def for_replica(self, url: str) -> "DatabaseSettings":
+        """The settings of a read replica: the same pool configuration with its own URL."""
+        return replace(self, url=url, replica_urls=())
+
+    @property
+    def is_asyncpg(self) -> bool:
+        return self.url.startswith("postgresql+asyncpg://")
+
+    @property
+    def max_connections(self) -> int:
+        """Upper bound of connections a single process can open with these settings."""
+        return self.pool_size + max(self.max_overflow, 0)
+
+    def connect_args(self) -> dict:
+        """Driver-level connection arguments for asyncpg."""
+        if not self.is_asyncpg:
+            return {}
+        args: dict = {}
+        if self.pgbouncer:
+            # PgBouncer in transaction mode hands each transaction to a different
+            # server connection, so named prepared statements cannot be reused,
+            # and it rejects unknown startup parameters such as statement_timeout
+            # (configure that on the database role instead).
+            args["statement_cache_size"] = 0
+            args["prepared_statement_cache_size"] = 0
+            args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+        elif self.statement_timeout_ms > 0:
+            args["server_settings"] = {"statement_timeout": str(self.statement_timeout_ms)}
+        return args
+
+    def engine_kwargs(self) -> dict:
+        """Keyword arguments for `create_async_engine`."""
+        from sqlalchemy.pool import NullPool
+
+        kwargs: dict = {
+            "echo": self.echo,
+            "pool_pre_ping": self.pool_pre_ping,
+            "connect_args": self.connect_args(),
+        }
+        if self.disable_pool:
+            kwargs["poolclass"] = NullPool
+        else:
+            kwargs.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+                pool_recycle=self.pool_recycle,
+            )
+        return kwargs
@@ -1,28 +1,44 @@
 # app/crud.py
 
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import Optional,List
-from . import models, schemas
-from .auth import get_password_hash # Import the password hashing utility
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm.attributes import set_committed_value
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, List, Tuple
+from . import aggregates, idempotency, inventory, models, schemas
+from .pagination import keyset_paginate
+from .queries import orders as order_queries
+from .queries import products as product_queries
+from .queries import users as user_queries
+from .auth import get_password_hash, invalidate_cached_user # Import the password hashing utility
+from .catalog import cache_product, invalidate_cached_product
+from .serialization import dump_json
 
 # --- User CRUD Operations ---
 
-def get_user(db: Session, user_id: int) -> Optional[models.User]:
+async def get_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
     """Retrieve a user by their ID."""
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return await db.scalar(select(models.User).where(models.User.id == user_id))
 
-def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
     """Retrieve a user by their email address."""
-    return db.query(models.User).filter(models.User.email == email).first()
+    return await db.scalar(select(models.User).where(models.User.email == email))
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]:
-    """Retrieve a list of users with pagination."""
-    return db.query(models.User).offset(skip).limit(limit).all()
+# Stable sort keys used for pagination; each is unique and backed by an index
+USER_SORT_KEY = user_queries.USER_SORT_KEY
+PRODUCT_SORT_KEY = product_queries.PRODUCT_SORT_KEY
+ORDER_SORT_KEY = order_queries.ORDER_SORT_KEY # Newest first, shared with the order query layer
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[models.User]:
+    """Retrieve a list of users with cursor (or legacy offset) pagination."""
+    stmt = keyset_paginate(select(models.User), USER_SORT_KEY, cursor=cursor, skip=skip, limit=limit)
+    result = await db.scalars(stmt)
+    return list(result.all())
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
     """Create a new user with a hashed password."""
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         hashed_password=hashed_password,
@@ -32,119 +48,363 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
         is_admin=user.is_admin # Set admin status
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate) -> Optional[models.User]:
+async def update_user(db: AsyncSession, user_id: int, user_update: schemas.UserUpdate) -> Optional[models.User]:
     """Update an existing user's information."""
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = await get_user(db, user_id)
     if db_user:
         update_data = user_update.model_dump(exclude_unset=True) # Use model_dump for Pydantic v2
         for key, value in update_data.items():
             setattr(db_user, key, value)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        invalidate_cached_user(user_id)
     return db_user
 
-def delete_user(db: Session, user_id: int) -> Optional[models.User]:
+async def delete_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
     """Delete a user by their ID."""
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = await get_user(db, user_id)
     if db_user:
-        db.delete(db_user)
-        db.commit()
+        await db.delete(db_user)
+        await db.commit()
+        invalidate_cached_user(user_id)
     return db_user
 
 # --- Product CRUD Operations ---
 
-def get_product(db: Session, product_id: int) -> Optional[models.Product]:
+async def get_product(db: AsyncSession, product_id: int) -> Optional[models.Product]:
     """Retrieve a product by its ID."""
-    return db.query(models.Product).filter(models.Product.id == product_id).first()
+    return await db.scalar(select(models.Product).where(models.Product.id == product_id))
 
-def get_products(db: Session, skip: int = 0, limit: int = 100) -> List[models.Product]:
-    """Retrieve a list of products with pagination."""
-    return db.query(models.Product).offset(skip).limit(limit).all()
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[models.Product]:
+    """Retrieve a list of products with cursor (or legacy offset) pagination."""
+    stmt = keyset_paginate(select(models.Product), PRODUCT_SORT_KEY, cursor=cursor, skip=skip, limit=limit)
+    result = await db.scalars(stmt)
+    return list(result.all())
 
-def create_product(db: Session, product: schemas.ProductCreate) -> models.Product:
+async def create_product(db: AsyncSession, product: schemas.ProductCreate) -> models.Product:
     """Create a new product."""
     db_product = models.Product(**product.model_dump()) # Use model_dump for Pydantic v2
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    await db.commit()
+    await db.refresh(db_product)
+    cache_product(db_product)
     return db_product
 
-def update_product(db: Session, product_id: int, product_update: schemas.ProductUpdate) -> Optional[models.Product]:
+async def update_product(db: AsyncSession, product_id: int, product_update: schemas.ProductUpdate) -> Optional[models.Product]:
     """Update an existing product's information."""
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    db_product = await get_product(db, product_id)
     if db_product:
         update_data = product_update.model_dump(exclude_unset=True) # Use model_dump for Pydantic v2
         for key, value in update_data.items():
             setattr(db_product, key, value)
-        db.commit()
-        db.refresh(db_product)
+        if db_product.stock_shards and update_data.get("quantity") is not None:
+            # The shards hold the stock of a sharded product
+            await inventory.set_stock(db, product_id, update_data["quantity"])
+        await db.commit()
+        await db.refresh(db_product)
+        cache_product(db_product) # Write-through: readers get the new payload immediately
     return db_product
 
-def delete_product(db: Session, product_id: int) -> Optional[models.Product]:
+async def delete_product(db: AsyncSession, product_id: int) -> Optional[models.Product]:
     """Delete a product by its ID."""
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    db_product = await get_product(db, product_id)
     if db_product:
-        db.delete(db_product)
-        db.commit()
+        await db.delete(db_product)
+        await db.commit()
+        invalidate_cached_product(product_id)
     return db_product
 
 # --- Order CRUD Operations ---
 
-def create_user_order(db: Session, order: schemas.OrderCreate, buyer_id: int) -> models.Order:
+PRODUCT_STOCK_COLUMNS = (
+    models.Product.id, models.Product.quantity, models.Product.selling_price, models.Product.buying_price, models.Product.stock_shards,
+)
+
+async def _lock_and_deduct_stock(db: AsyncSession, requested: Dict[int, int]) -> Dict[int, Row]:
     """
-    Create a new order for a user.
-    This function handles deducting product quantities and calculating total amount.
+    Lock the requested products and deduct their quantities in two round trips.
+    `requested` maps product ids to the total quantity ordered. Returns the product rows
+    (id, quantity before deduction, selling_price, buying_price, stock_shards) keyed by id.
+    Products with inventory shards are not locked: their stock is deducted from one of
+    their shards (see `app.inventory`), which costs one more round trip per product.
+    Raises ValueError if a product is missing or does not have enough stock.
     """
-    total_amount = 0
-    db_order_items = []
+    if not requested:
+        return {}
+    product_ids = sorted(requested)
 
-    for item_in in order.items:
-        product = get_product(db, item_in.product_id)
-        if not product or product.quantity < item_in.quantity:
+    # Rows are locked in ascending id order so concurrent checkouts cannot deadlock each other
+    locked_rows = await db.execute(
+        select(*PRODUCT_STOCK_COLUMNS)
+        .where(models.Product.id.in_(product_ids), models.Product.stock_shards == 0)
+        .order_by(models.Product.id)
+        .with_for_update()
+    )
+    products = {row.id: row for row in locked_rows}
+    unlocked_ids = [product_id for product_id in product_ids if product_id not in products]
+    if unlocked_ids:
+        sharded_rows = await db.execute(select(*PRODUCT_STOCK_COLUMNS).where(models.Product.id.in_(unlocked_ids)))
+        sharded = {row.id: row for row in sharded_rows}
+    else:
+        sharded = {}
+    for product_id in product_ids:
+        product = products.get(product_id)
+        if product_id in sharded:
+            continue
+        if not product or product.quantity < requested[product_id]:
             # You might want to raise an HTTPException here in the router
             # For CRUD, we'll return None or handle it as an error.
-            raise ValueError(f"Product {item_in.product_id} not found or insufficient quantity.")
+            raise ValueError(f"Product {product_id} not found or insufficient quantity.")
 
-        # Deduct quantity from inventory
-        product.quantity -= item_in.quantity
-        db.add(product) # Mark product for update
+    if products:
+        # Deduct all quantities with a single set-based statement.
+        # The quantity guard keeps stock from going negative even if a row was not locked.
+        amount = case({product_id: requested[product_id] for product_id in products}, value=models.Product.id)
+        updated = await db.execute(
+            update(models.Product)
+            .where(models.Product.id.in_(list(products)), models.Product.quantity >= amount)
+            .values(quantity=models.Product.quantity - amount)
+            .returning(models.Product.id)
+            .execution_options(synchronize_session=False)
+        )
+        if len(updated.all()) != len(products):
+            raise ValueError("Insufficient quantity for one or more products.")
+    for product_id in sorted(sharded):
+        await inventory.deduct_from_shards(db, product_id, requested[product_id])
+    return {**products, **sharded}
 
-        # Calculate price for this item based on selling price at time of purchase
-        item_total = item_in.quantity * product.selling_price
-        total_amount += item_total
+async def _take_over_reservation(db: AsyncSession, reservation_id: int, buyer_id: int) -> Dict[int, int]:
+    """
+    Deletes a buyer's unexpired reservation in the caller's transaction and returns the
+    quantities it held by product id. Raises ValueError if there is no such reservation.
+    """
+    Reservation, Item = models.InventoryReservation, models.InventoryReservationItem
+    # The lock keeps the reconciler from expiring the reservation meanwhile
+    locked = await db.scalar(
+        select(Reservation.id)
+        .where(Reservation.id == reservation_id, Reservation.buyer_id == buyer_id, Reservation.expires_at > datetime.now(timezone.utc))
+        .with_for_update()
+    )
+    if locked is None:
+        raise ValueError(f"Reservation {reservation_id} not found or expired.")
+    items = await db.execute(delete(Item).where(Item.reservation_id == reservation_id).returning(Item.product_id, Item.quantity))
+    reserved = {product_id: quantity for product_id, quantity in items}
+    await db.execute(delete(Reservation).where(Reservation.id == reservation_id))
+    return reserved
 
-        db_order_item = models.OrderItem(
-            product_id=item_in.product_id,
-            quantity=item_in.quantity,
-            price_at_purchase=product.selling_price # Store the price at time of purchase
-        )
-        db_order_items.append(db_order_item)
+async def create_reservation(db: AsyncSession, reservation: schemas.ReservationCreate, buyer_id: int) -> models.InventoryReservation:
+    """
+    Hold stock for a buyer for INVENTORY_RESERVATION_TTL_SECONDS: the quantities are
+    deducted now, and returned by the reconciler unless an order takes the reservation
+    over before it expires. Raises ValueError if a product does not have enough stock.
+    """
+    requested: Dict[int, int] = {}
+    for item_in in reservation.items:
+        requested[item_in.product_id] = requested.get(item_in.product_id, 0) + item_in.quantity
+    await _lock_and_deduct_stock(db, requested)
+    db_reservation = models.InventoryReservation(
+        buyer_id=buyer_id,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=inventory.INVENTORY_RESERVATION_TTL_SECONDS),
+        items=[
+            models.InventoryReservationItem(product_id=product_id, quantity=quantity)
+            for product_id, quantity in requested.items()
+        ],
+    )
+    db.add(db_reservation)
+    await db.commit()
+    for product_id in requested:
+        invalidate_cached_product(product_id)
+    return db_reservation
+
+async def release_reservation(db: AsyncSession, reservation_id: int, buyer_id: int) -> bool:
+    """Return the stock of a buyer's reservation before it expires. Returns False if there is none."""
+    try:
+        reserved = await _take_over_reservation(db, reservation_id, buyer_id)
+    except ValueError:
+        return False
+    await inventory.restock(db, reserved)
+    await db.commit()
+    for product_id in reserved:
+        invalidate_cached_product(product_id)
+    return True
+
+ORDER_STATUS_PATH = "/orders/{order_id}/status"
+
+async def deduct_order_stock(db: AsyncSession, order: schemas.OrderCreate, buyer_id: int) -> Tuple[Dict[int, Row], List[int]]:
+    """
+    Deducts the stock of an order, or takes it from the order's reservation. Returns the
+    product rows keyed by id (see `_lock_and_deduct_stock`) and the ids of the products
+    whose stock changed. Raises ValueError if the stock or the reservation is missing.
+    """
+    # Merge repeated lines for the same product so each row is locked and decremented once
+    requested: Dict[int, int] = {}
+    for item_in in order.items:
+        requested[item_in.product_id] = requested.get(item_in.product_id, 0) + item_in.quantity
+    if order.reservation_id is None:
+        return await _lock_and_deduct_stock(db, requested), list(requested)
+
+    reserved = await _take_over_reservation(db, order.reservation_id, buyer_id)
+    to_deduct = {product_id: quantity - reserved.get(product_id, 0) for product_id, quantity in requested.items()}
+    products = await _lock_and_deduct_stock(db, {product_id: amount for product_id, amount in to_deduct.items() if amount > 0})
+    # Products fully covered by the reservation only need their prices
+    covered = [product_id for product_id in requested if product_id not in products]
+    if covered:
+        rows = await db.execute(select(*PRODUCT_STOCK_COLUMNS).where(models.Product.id.in_(covered)))
+        products.update({row.id: row for row in rows})
+    missing = set(requested) - set(products)
+    if missing:
+        raise ValueError(f"Product {min(missing)} not found or insufficient quantity.")
+    await inventory.restock(db, {product_id: quantity - requested.get(product_id, 0) for product_id, quantity in reserved.items()})
+    return products, list(set(requested) | set(reserved))
+
+async def _insert_order(db: AsyncSession, order: schemas.OrderCreate, buyer_id: int, selling_prices: Dict[int, float], status: str) -> models.Order:
+    """
+    Inserts an order with the given status and its items (one flush and one batched
+    INSERT) at the given selling prices. The returned order is fully populated (including its items and
+    server-generated columns) from the inserted rows, so it can be serialized without
+    another query.
+    """
+    # Calculate the total based on selling prices at time of purchase
+    total_amount = sum(item_in.quantity * selling_prices[item_in.product_id] for item_in in order.items)
 
     db_order = models.Order(
         buyer_id=buyer_id,
         total_amount=total_amount,
+        status=status,
         shipping_address=order.shipping_address,
-        items=db_order_items # Link order items to the order
     )
-
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    await db.flush() # Assigns the order id; server defaults such as created_at come back via RETURNING
+
+    db_order_items: List[models.OrderItem] = []
+    if order.items:
+        inserted_items = await db.scalars(
+            # Without `sort_by_parameter_order`, which SQLite can only honour one row at a time
+            insert(models.OrderItem).returning(models.OrderItem),
+            [
+                {
+                    "order_id": db_order.id,
+                    "product_id": item_in.product_id,
+                    "quantity": item_in.quantity,
+                    "price_at_purchase": selling_prices[item_in.product_id], # Store the price at time of purchase
+                }
+                for item_in in order.items
+            ],
+        )
+        # Ids follow the VALUES order; the order queries list items by id as well
+        db_order_items = sorted(inserted_items.all(), key=lambda item: item.id)
+    # Attach the inserted items as the loaded collection, so the order can be returned
+    # without another query
+    set_committed_value(db_order, "items", db_order_items)
     return db_order
 
-def get_orders(db: Session, skip: int = 0, limit: int = 100) -> List[models.Order]:
-    """Retrieve a list of all orders with pagination."""
-    return db.query(models.Order).offset(skip).limit(limit).all()
+async def record_order_sales(db: AsyncSession, db_order: models.Order, products: Dict[int, Row]) -> None:
+    """Adds an order (with its items loaded) to the sales aggregates, in the caller's transaction."""
+    await aggregates.record_order(
+        db, db_order, db_order.items,
+        {product_id: row.buying_price for product_id, row in products.items()},
+        sales_buckets={product_id: row.stock_shards for product_id, row in products.items() if row.stock_shards},
+    )
 
-def get_user_orders(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[models.Order]:
-    """Retrieve a list of orders for a specific user with pagination."""
-    return db.query(models.Order).filter(models.Order.buyer_id == user_id).offset(skip).limit(limit).all()
+async def create_user_order(db: AsyncSession, order: schemas.OrderCreate, buyer_id: int, idempotency_key: Optional[str] = None) -> models.Order:
+    """
+    Create a new order for a user, `confirmed` since its stock is deducted right away.
+    This function handles deducting product quantities and calculating total amount.
+    The number of round trips is constant regardless of how many items are in the cart:
+    products are locked with one `SELECT ... FOR UPDATE`, stock is decremented with one
+    `UPDATE ... WHERE quantity >= n`, the order items are bulk-inserted in one batch and
+    the sales aggregates are updated with three upserts.
+    With an `idempotency_key` (already claimed in this transaction with
+    `idempotency.claim`), the response is stored with the order.
+    With a `reservation_id`, the reserved stock is used first and whatever the order
+    does not need of it is returned.
+    """
+    products, changed = await deduct_order_stock(db, order, buyer_id)
+    # The stock is deducted in the same transaction, so the order is confirmed right away
+    db_order = await _insert_order(db, order, buyer_id, {product_id: row.selling_price for product_id, row in products.items()}, "confirmed")
+    # Keep the sales aggregates in step with the orders, in the same transaction
+    await record_order_sales(db, db_order, products)
+    if idempotency_key is not None:
+        await idempotency.save_response(db, buyer_id, idempotency_key, db_order)
+    await db.commit()
+    # Cached product payloads carry the stock level, which just changed
+    for product_id in changed:
+        invalidate_cached_product(product_id)
+    return db_order
 
-def get_order(db: Session, order_id: int) -> Optional[models.Order]:
-    """Retrieve a single order by its ID."""
-    return db.query(models.Order).filter(models.Order.id == order_id).first()
+def _processing_status(order: models.Order, job: Optional[models.OrderJob]) -> dict:
+    """`OrderProcessingResponse` fields; orders without a job were processed on submission (or long ago)."""
+    return {
+        "order_id": order.id,
+        "status": order.status,
+        "state": job.state if job is not None else "done",
+        "attempts": job.attempts if job is not None else 0,
+        "last_error": job.last_error if job is not None else None,
+        "status_url": ORDER_STATUS_PATH.format(order_id=order.id),
+    }
 
+async def enqueue_user_order(db: AsyncSession, order: schemas.OrderCreate, buyer_id: int, idempotency_key: Optional[str] = None) -> dict:
+    """
+    Accept an order for asynchronous processing (ORDER_INTAKE_MODE=queued).
+    The order and its items are recorded as `pending` at the current selling prices
+    together with a queued `OrderJob`, without locking anything; `app.worker` deducts
+    the stock later and confirms the order, or cancels it if it cannot. Returns the
+    processing status (`OrderProcessingResponse` fields). Raises ValueError if a
+    product does not exist.
+    """
+    product_ids = {item_in.product_id for item_in in order.items}
+    selling_prices = dict((await db.execute(
+        select(models.Product.id, models.Product.selling_price).where(models.Product.id.in_(product_ids))
+    )).all())
+    missing = product_ids - set(selling_prices)
+    if missing:
+        raise ValueError(f"Product {min(missing)} not found.")
+    db_order = await _insert_order(db, order, buyer_id, selling_prices, "pending")
+    job = models.OrderJob(order_id=db_order.id, state="queued", attempts=0, payload=order.model_dump_json(exclude_none=True).encode())
+    db.add(job)
+    await db.flush()
+    processing = _processing_status(db_order, job)
+    if idempotency_key is not None:
+        await idempotency.save_response(
+            db, buyer_id, idempotency_key, db_order, status_code=202,
+            body=dump_json(schemas.OrderProcessingResponse, processing),
+        )
+    await db.commit()
+    return processing
+
+async def get_order_processing(db: AsyncSession, order_id: int) -> Optional[Tuple[int, dict]]:
+    """Returns the buyer and the processing status of an order, or None if it does not exist."""
+    row = (await db.execute(
+        select(models.Order, models.OrderJob)
+        .outerjoin(models.OrderJob, models.OrderJob.order_id == models.Order.id)
+        .where(models.Order.id == order_id)
+    )).first()
+    if row is None:
+        return None
+    order, job = row
+    return order.buyer_id, _processing_status(order, job)
+
+async def get_orders(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[models.Order]:
+    """Retrieve a list of all orders, newest first, with cursor (or legacy offset) pagination."""
+    stmt = keyset_paginate(
+        select(models.Order), ORDER_SORT_KEY, cursor=cursor, skip=skip, limit=limit, descending=True
+    )
+    result = await db.scalars(stmt)
+    return list(result.all())
+
+async def get_user_orders(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[models.Order]:
+    """Retrieve a list of orders for a specific user, newest first, with cursor (or legacy offset) pagination."""
+    stmt = keyset_paginate(
+        select(models.Order).where(models.Order.buyer_id == user_id),
+        ORDER_SORT_KEY, cursor=cursor, skip=skip, limit=limit, descending=True,
+    )
+    result = await db.scalars(stmt)
+    return list(result.all())
+
+async def get_order(db: AsyncSession, order_id: int) -> Optional[models.Order]:
+    """Retrieve a single order by its ID."""
+    return await db.scalar(select(models.Order).where(models.Order.id == order_id))
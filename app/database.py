@@ -1,34 +1,91 @@
 # app/database.py
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-# Database connection URL.
-# This will be read from environment variables in a real application,
-# but for Docker Compose, we'll use the service name 'db' for PostgreSQL.
-DATABASE_URL = "postgresql://user:password@db/ecommerce"
-
-# Create the SQLAlchemy engine.
-# The 'echo=True' argument will log all SQL statements, which is useful for debugging.
-engine = create_engine(DATABASE_URL, echo=True)
-
-# Create a SessionLocal class.
-# Each instance of SessionLocal will be a database session.
-# The 'autocommit=False' means changes won't be committed automatically.
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+
+from .config import DatabaseSettings
+from .metrics.db_pool import InstrumentedAsyncAdaptedQueuePool, instrument_engine_pool
+from .metrics.db_queries import instrument_engine_queries
+from .metrics.prometheus_exporter import DB_READ_SESSIONS_TOTAL
+from .replicas import ReplicaSet
+
+# Engine and pool settings.
+# These are read from environment variables (DATABASE_URL, DB_POOL_SIZE, DB_ECHO, ...);
+# for Docker Compose the default URL uses the service name 'db' for PostgreSQL.
+# The 'asyncpg' driver lets every request await the database instead of
+# blocking one of Starlette's threadpool workers.
+settings = DatabaseSettings.from_env()
+DATABASE_URL = settings.url
+
+# Create the async SQLAlchemy engine.
+# SQL echo is off unless DB_ECHO is set, since logging every statement is expensive.
+# The pool reports checkout wait time and occupancy to Prometheus, and every statement
+# is attributed to the HTTP request that issued it (count, DB time and rows per route).
+engine_kwargs = settings.engine_kwargs()
+engine_kwargs.setdefault("poolclass", InstrumentedAsyncAdaptedQueuePool)
+engine = create_async_engine(DATABASE_URL, pool_logging_name="primary", **engine_kwargs)
+instrument_engine_pool(engine)
+instrument_engine_queries(engine)
+
+# Read replicas (DATABASE_REPLICA_URLS), each with its own instrumented pool labelled
+# "replica<n>" in the pool metrics. Without replicas every read goes to the primary.
+# The replicas share the primary's pool settings (and its instrumented pool class).
+replica_engines = [
+    create_async_engine(url, pool_logging_name=f"replica{index}", **engine_kwargs)
+    for index, url in enumerate(settings.replica_urls)
+]
+for replica_engine in replica_engines:
+    instrument_engine_pool(replica_engine)
+    instrument_engine_queries(replica_engine)
+replicas = ReplicaSet(replica_engines)
+
+# Create an AsyncSessionLocal class.
+# Each instance of AsyncSessionLocal will be an asynchronous database session.
 # The 'autoflush=False' means changes won't be flushed to the database automatically.
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The 'expire_on_commit=False' keeps loaded attributes usable after commit, since
+# lazy refreshes are not possible once the session is outside of an await.
+AsyncSessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 # Create a Base class for declarative models.
 # All SQLAlchemy models will inherit from this Base.
 Base = declarative_base()
 
 # Dependency to get a database session.
-# This function will be used with FastAPI's Depends to inject a database session
-# into path operation functions.
-def get_db():
-    db = SessionLocal()
-    try:
+# This function will be used with FastAPI's Depends to inject an async database
+# session into path operation functions.
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
+
+
+@asynccontextmanager
+async def read_session() -> AsyncIterator[AsyncSession]:
+    """
+    Opens a session for reads that tolerate replication lag, on a replica when one is
+    available and on the primary otherwise. Nothing written through it is persisted
+    on a replica, so use `AsyncSessionLocal` for writes.
+    """
+    replica = replicas.acquire()
+    if replica is None:
+        DB_READ_SESSIONS_TOTAL.labels(engine="primary").inc()
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    DB_READ_SESSIONS_TOTAL.labels(engine=replica.name).inc()
+    try:
+        async with replica.sessionmaker() as db:
+            yield db
     finally:
-        db.close()
\ No newline at end of file
+        replicas.release(replica)
+
+# Dependency to get a read-only database session (see `read_session`).
+# For endpoints whose data may be slightly stale, such as admin listings and reports;
+# responses that must reflect a write just made use `get_db`.
+async def get_read_db():
+    async with read_session() as db:
+        yield db
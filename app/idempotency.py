@@ -0,0 +1,157 @@
+# app/idempotency.py
+
+"""
+Idempotent order submission (`Idempotency-Key` header on `POST /orders/`).
+
+The key is claimed with an `INSERT ... ON CONFLICT` into `idempotency_keys` in the
+same transaction that creates the order, and the response is stored in that
+transaction too. So a key either has no row or a row with its response, never an
+order without one:
+- a retry after the order was committed gets the stored response back;
+- a duplicate sent while the first request is still running blocks on the key's
+  unique index until that transaction ends, then gets its response (or takes over
+  the key if it rolled back). It never reaches the stock checks in the meantime.
+
+Keys expire after IDEMPOTENCY_KEY_TTL_HOURS: an expired key may be reused, and
+expired rows are purged periodically by each worker and by `python -m app.idempotency`.
+"""
+
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import orjson
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models, schemas
+from .config import env_float, env_int
+from .serialization import dump_json
+
+# How long a key (and its stored response) is kept
+IDEMPOTENCY_KEY_TTL_HOURS = env_float("IDEMPOTENCY_KEY_TTL_HOURS", 24.0)
+
+# Seconds between purges of expired keys in each worker (0 disables, e.g. when the
+# purge runs from cron instead)
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = env_float("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", 3600.0)
+
+# Rows deleted per purge transaction, to keep locks and WAL bursts small
+IDEMPOTENCY_PURGE_BATCH_SIZE = env_int("IDEMPOTENCY_PURGE_BATCH_SIZE", 1000)
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used by the same buyer for a different request."""
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    """The response of the request that first used a key."""
+    status_code: int
+    body: bytes
+
+
+def request_hash(order: schemas.OrderCreate) -> str:
+    """SHA-256 of the order request, independent of key order and formatting."""
+    # Unset optional fields are left out, so adding one does not change existing hashes
+    return hashlib.sha256(orjson.dumps(order.model_dump(exclude_none=True), option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def _expiry_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+async def claim(db: AsyncSession, buyer_id: int, key: str, hashed_request: str) -> Optional[StoredResponse]:
+    """
+    Claims `key` in the session's transaction, which must go on to create the order and
+    `save_response` before committing. Returns None when the caller now owns the key,
+    or the stored response when an earlier request with this key completed.
+    Raises IdempotencyKeyReused if that request was a different one.
+    """
+    IdempotencyKey = models.IdempotencyKey
+    insert_ = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = insert_(IdempotencyKey).values(buyer_id=buyer_id, key=key, request_hash=hashed_request)
+    # An expired key is taken over as if it were new
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.buyer_id, IdempotencyKey.key],
+        set_={
+            "request_hash": stmt.excluded.request_hash, "created_at": func.now(),
+            "order_id": None, "status_code": None, "response_body": None,
+        },
+        where=IdempotencyKey.created_at < _expiry_cutoff(),
+    ).returning(IdempotencyKey.buyer_id)
+    while True:
+        if (await db.execute(stmt)).first() is not None:
+            return None
+        stored = (await db.execute(
+            select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response_body)
+            .where(IdempotencyKey.buyer_id == buyer_id, IdempotencyKey.key == key)
+        )).first()
+        if stored is not None:
+            break
+        # The key expired and was purged in between: claim it again, as a new key
+    if stored.request_hash != hashed_request:
+        raise IdempotencyKeyReused(key)
+    return StoredResponse(status_code=stored.status_code, body=stored.response_body)
+
+
+async def save_response(
+    db: AsyncSession, buyer_id: int, key: str, order: models.Order, status_code: int = 201, body: Optional[bytes] = None,
+) -> None:
+    """
+    Stores the response for a claimed key, in the transaction that creates the order.
+    The body defaults to the order as `OrderResponse`.
+    """
+    if body is None:
+        body = dump_json(schemas.OrderResponse, order)
+    await db.execute(
+        update(models.IdempotencyKey)
+        .where(models.IdempotencyKey.buyer_id == buyer_id, models.IdempotencyKey.key == key)
+        .values(order_id=order.id, status_code=status_code, response_body=body)
+    )
+
+
+async def purge_expired(db: AsyncSession, batch_size: int = IDEMPOTENCY_PURGE_BATCH_SIZE) -> int:
+    """Deletes expired keys in batches, one transaction each. Returns the number deleted."""
+    IdempotencyKey = models.IdempotencyKey
+    cutoff = _expiry_cutoff()
+    deleted = 0
+    while True:
+        expired = (
+            select(IdempotencyKey.buyer_id, IdempotencyKey.key)
+            .where(IdempotencyKey.created_at < cutoff)
+            .limit(batch_size)
+        )
+        result = await db.execute(
+            delete(IdempotencyKey)
+            .where(tuple_(IdempotencyKey.buyer_id, IdempotencyKey.key).in_(expired))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+async def purge_periodically(interval: float = IDEMPOTENCY_PURGE_INTERVAL_SECONDS) -> None:
+    """Background task that purges expired keys every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await purge_expired(db)
+        except Exception as e:
+            print(f"Purging expired idempotency keys failed: {e!r}")
+
+
+async def main() -> None:
+    async with database.AsyncSessionLocal() as db:
+        deleted = await purge_expired(db)
+    print(f"Purged {deleted} expired idempotency keys.")
+    await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,295 @@
+# app/inventory.py
+
+"""
+Inventory shards for hot products, and expiry of stock reservations.
+
+Every checkout of a product locks its `products` row until the order commits, so
+during a flash sale the checkouts of a popular product run one at a time. Splitting
+its stock over `stock_shards` rows of `inventory_shards` (`configure_shards`) lets
+that many checkouts proceed at once: each decrements a shard picked at random among
+those no other transaction holds (`FOR UPDATE SKIP LOCKED`), and only falls back to
+locking every shard when no single shard has enough stock left.
+
+The shards are authoritative for a sharded product's stock; `products.quantity` is
+a copy of their total for readers. The reconciler (`reconcile`, run periodically by
+every worker and by `python -m app.inventory`):
+- writes the shards' total back to `products.quantity`;
+- evens out shards that drifted apart, so single-shard decrements keep succeeding;
+- returns the stock of reservations that expired without being ordered.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+from .catalog import invalidate_cached_product
+from .config import env_float, env_int
+
+# Upper bound for a product's shard count
+INVENTORY_MAX_SHARDS = env_int("INVENTORY_MAX_SHARDS", 64)
+
+# How long stock stays reserved for a buyer who has not ordered it yet
+INVENTORY_RESERVATION_TTL_SECONDS = env_float("INVENTORY_RESERVATION_TTL_SECONDS", 600.0)
+
+# Seconds between reconciler runs in each worker (0 disables, e.g. when it runs from cron)
+INVENTORY_RECONCILE_INTERVAL_SECONDS = env_float("INVENTORY_RECONCILE_INTERVAL_SECONDS", 5.0)
+
+# A sharded product is rebalanced when one of its shards holds less than this
+# fraction of an even share (1 / stock_shards of the total)
+INVENTORY_REBALANCE_THRESHOLD = env_float("INVENTORY_REBALANCE_THRESHOLD", 0.5)
+
+# Expired reservations returned per reconciler transaction
+INVENTORY_EXPIRY_BATCH_SIZE = env_int("INVENTORY_EXPIRY_BATCH_SIZE", 500)
+
+
+def _even_split(total: int, shards: int) -> List[int]:
+    """`total` split over `shards` shares that differ by at most one."""
+    share, remainder = divmod(total, shards)
+    return [share + 1 if shard < remainder else share for shard in range(shards)]
+
+
+async def _lock_shards(db: AsyncSession, product_id: int) -> List[models.InventoryShard]:
+    # In shard order, so transactions locking all shards of a product cannot deadlock
+    return list((await db.scalars(
+        select(models.InventoryShard)
+        .where(models.InventoryShard.product_id == product_id)
+        .order_by(models.InventoryShard.shard)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )).all())
+
+
+def _free_shard(product_id: int, at_least: int = 0):
+    """Subquery picking a random shard with `at_least` stock that no other transaction holds."""
+    Shard = models.InventoryShard
+    return (
+        select(Shard.shard)
+        .where(Shard.product_id == product_id, Shard.quantity >= at_least)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+
+
+async def _add_to_free_shard(db: AsyncSession, product_id: int, amount: int, at_least: int = 0):
+    """Adds `amount` (negative to deduct) to a free shard; returns the shard, or None if none qualified."""
+    Shard = models.InventoryShard
+    return await db.scalar(
+        update(Shard)
+        .where(Shard.product_id == product_id, Shard.shard == _free_shard(product_id, at_least), Shard.quantity >= at_least)
+        .values(quantity=Shard.quantity + amount)
+        .returning(Shard.shard)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _redistribute(db: AsyncSession, shards: List[models.InventoryShard], total: int) -> None:
+    """Sets locked shards to an even split of `total`."""
+    for shard, quantity in zip(shards, _even_split(total, len(shards))):
+        shard.quantity = quantity
+    await db.flush()
+
+
+async def get_inventory(db: AsyncSession, product_id: int) -> Optional[dict]:
+    """A product's stock and its shards (`InventoryResponse` fields), or None if it does not exist."""
+    product = (await db.execute(
+        select(models.Product.quantity, models.Product.stock_shards).where(models.Product.id == product_id)
+    )).first()
+    if product is None:
+        return None
+    shards = (await db.execute(
+        select(models.InventoryShard.shard, models.InventoryShard.quantity)
+        .where(models.InventoryShard.product_id == product_id)
+        .order_by(models.InventoryShard.shard)
+    )).all()
+    # The shards are more current than `products.quantity`, which waits for the reconciler
+    quantity = sum(shard.quantity for shard in shards) if product.stock_shards else product.quantity
+    return {"product_id": product_id, "quantity": quantity, "stock_shards": product.stock_shards, "shards": shards}
+
+
+async def configure_shards(db: AsyncSession, product_id: int, shards: int) -> models.Product:
+    """
+    Splits a product's stock over `shards` inventory shards (0 merges it back into
+    `products.quantity`) and commits. Raises LookupError if the product does not exist.
+    """
+    if not 0 <= shards <= INVENTORY_MAX_SHARDS:
+        raise ValueError(f"A product can have 0 to {INVENTORY_MAX_SHARDS} inventory shards.")
+    # The product row lock keeps concurrent reconfigurations and unsharded checkouts out
+    product = await db.scalar(select(models.Product).where(models.Product.id == product_id).with_for_update())
+    if product is None:
+        raise LookupError(product_id)
+    current = await _lock_shards(db, product_id)
+    total = sum(shard.quantity for shard in current) if product.stock_shards else product.quantity or 0
+
+    await db.execute(delete(models.InventoryShard).where(models.InventoryShard.product_id == product_id))
+    if shards:
+        await db.execute(insert(models.InventoryShard), [
+            {"product_id": product_id, "shard": shard, "quantity": quantity}
+            for shard, quantity in enumerate(_even_split(total, shards))
+        ])
+    product.stock_shards = shards
+    product.quantity = total
+    await db.commit()
+    await db.refresh(product)
+    invalidate_cached_product(product_id)
+    return product
+
+
+async def set_stock(db: AsyncSession, product_id: int, quantity: int) -> None:
+    """Sets a sharded product's stock to `quantity`, split evenly over its shards (caller commits)."""
+    await _redistribute(db, await _lock_shards(db, product_id), quantity)
+
+
+async def deduct_from_shards(db: AsyncSession, product_id: int, amount: int) -> None:
+    """
+    Deducts `amount` from a sharded product's stock, in the caller's transaction.
+    Raises ValueError if the product does not have enough stock.
+    """
+    # A random shard with enough stock that no other checkout holds right now
+    if await _add_to_free_shard(db, product_id, -amount, at_least=amount) is not None:
+        return
+
+    # Every shard with enough stock is busy, or none has enough on its own: wait for
+    # all of them and take the amount from the fullest ones
+    shards = await _lock_shards(db, product_id)
+    if sum(shard.quantity for shard in shards) < amount:
+        raise ValueError(f"Product {product_id} not found or insufficient quantity.")
+    remaining = amount
+    for shard in sorted(shards, key=lambda shard: shard.quantity, reverse=True):
+        taken = min(shard.quantity, remaining)
+        shard.quantity -= taken
+        remaining -= taken
+        if not remaining:
+            break
+    await db.flush()
+
+
+async def restock(db: AsyncSession, quantities: Dict[int, int]) -> None:
+    """
+    Returns stock to products (e.g. of a released reservation), in the caller's
+    transaction: to a random shard of sharded products, to `quantity` otherwise.
+    """
+    quantities = {product_id: amount for product_id, amount in quantities.items() if amount > 0}
+    if not quantities:
+        return
+    shard_counts = dict((await db.execute(
+        select(models.Product.id, models.Product.stock_shards).where(models.Product.id.in_(quantities))
+    )).all())
+    # Products in ascending id order, as checkouts lock them
+    for product_id in sorted(shard_counts):
+        amount = quantities[product_id]
+        if shard_counts[product_id]:
+            if await _add_to_free_shard(db, product_id, amount) is not None:
+                continue
+            shards = await _lock_shards(db, product_id)
+            if shards:
+                shards[0].quantity += amount
+                await db.flush()
+                continue
+            # The product was merged back into `quantity` in the meantime
+        await db.execute(
+            update(models.Product)
+            .where(models.Product.id == product_id)
+            .values(quantity=models.Product.quantity + amount)
+        )
+
+
+async def expire_reservations(db: AsyncSession, batch_size: int = INVENTORY_EXPIRY_BATCH_SIZE) -> int:
+    """Returns the stock of expired reservations and deletes them, in batches. Returns the number expired."""
+    Reservation, Item = models.InventoryReservation, models.InventoryReservationItem
+    expired_count = 0
+    while True:
+        # Reservations being taken over by an order right now are skipped; they are gone
+        # once that order commits
+        expired = (await db.scalars(
+            select(Reservation.id)
+            .where(Reservation.expires_at <= datetime.now(timezone.utc))
+            .order_by(Reservation.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )).all()
+        if expired:
+            items = (await db.execute(
+                delete(Item).where(Item.reservation_id.in_(expired)).returning(Item.product_id, Item.quantity)
+            )).all()
+            returned: Dict[int, int] = {}
+            for product_id, quantity in items:
+                returned[product_id] = returned.get(product_id, 0) + quantity
+            await restock(db, returned)
+            await db.execute(delete(Reservation).where(Reservation.id.in_(expired)))
+        await db.commit()
+        expired_count += len(expired)
+        if len(expired) < batch_size:
+            return expired_count
+
+
+async def reconcile_product(db: AsyncSession, product_id: int) -> bool:
+    """
+    Rebalances a sharded product's shards if needed and writes their total to
+    `products.quantity`. Returns False, writing nothing, if the product is not sharded
+    (any more): its `quantity` is then the real stock.
+    """
+    # The product row lock keeps `configure_shards` from merging the shards meanwhile,
+    # which would make the total written below stale
+    shards = await db.scalar(
+        select(models.Product.stock_shards).where(models.Product.id == product_id).with_for_update()
+    )
+    Shard = models.InventoryShard
+    quantities = (await db.scalars(select(Shard.quantity).where(Shard.product_id == product_id))).all() if shards else []
+    if not quantities:
+        await db.commit()
+        return False
+    total = sum(quantities)
+    # A shard that runs low makes checkouts fall back to locking every shard; only then
+    # are the shards locked to even them out
+    if min(quantities) < total / shards * INVENTORY_REBALANCE_THRESHOLD:
+        locked = await _lock_shards(db, product_id)
+        total = sum(shard.quantity for shard in locked)
+        await _redistribute(db, locked, total)
+    updated = await db.execute(
+        update(models.Product)
+        .where(models.Product.id == product_id, models.Product.stock_shards > 0, models.Product.quantity.is_distinct_from(total))
+        .values(quantity=total)
+    )
+    await db.commit()
+    if updated.rowcount:
+        invalidate_cached_product(product_id)
+    return True
+
+
+async def reconcile(db: AsyncSession) -> int:
+    """Expires reservations and reconciles every sharded product, one transaction each. Returns the products reconciled."""
+    await expire_reservations(db)
+    sharded = (await db.scalars(select(models.Product.id).where(models.Product.stock_shards > 0))).all()
+    await db.commit()
+    reconciled = 0
+    for product_id in sharded:
+        reconciled += await reconcile_product(db, product_id)
+    return reconciled
+
+
+async def reconcile_periodically(interval: float = INVENTORY_RECONCILE_INTERVAL_SECONDS) -> None:
+    """Background task that runs the reconciler every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await reconcile(db)
+        except Exception as e:
+            print(f"Inventory reconciliation failed: {e!r}")
+
+
+async def main() -> None:
+    async with database.AsyncSessionLocal() as db:
+        reconciled = await reconcile(db)
+    print(f"Reconciled {reconciled} sharded products.")
+    await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,15 +1,16 @@
 # app/main.py
 
 from fastapi import FastAPI, Response, status
-from fastapi.responses import PlainTextResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import asyncio
 
-from .database import engine, Base, get_db
+from . import idempotency, inventory
+from .database import engine, replicas
+from .passwords import password_hasher
 from .routers import users, products, orders
 from .metrics.middleware import PrometheusMiddleware
-from .metrics.prometheus_exporter import get_prometheus_metrics
+from .metrics.prometheus_exporter import get_prometheus_metrics, mark_process_dead
 from .metrics.system_collector import collect_system_metrics
 
 
@@ -18,24 +19,43 @@ from .metrics.system_collector import collect_system_metrics
 async def lifespan(app: FastAPI):
     """
     Handles startup and shutdown events for the FastAPI application.
-    - Creates database tables on startup if they don't exist.
     - Starts the system metrics collection background task.
+    - Checks the read replicas (if any) and starts monitoring their replication lag.
+    - Starts the periodic purge of expired idempotency keys.
+    - Starts the inventory reconciler (shard totals, expired reservations).
+    The background tasks are cancelled on shutdown, before the database engines they
+    use are disposed.
+    The database schema is managed by migrations (`alembic upgrade head`), which
+    run before the application starts instead of on every startup.
     """
-    # Create database tables if they don't exist
-    print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
-    print("Database tables created (or already exist).")
-
+    # The event loop only keeps weak references to tasks, so the handles are kept here
+    background_tasks = []
     # Start the background task for system metrics collection
     # We use asyncio.create_task to run it concurrently with the main app
     print("Starting system metrics collector...")
-    asyncio.create_task(collect_system_metrics())
+    background_tasks.append(asyncio.create_task(collect_system_metrics()))
     print("System metrics collector started.")
+    if replicas.replicas:
+        await replicas.check()
+        background_tasks.append(asyncio.create_task(replicas.monitor()))
+        print(f"Routing reads to {len(replicas.replicas)} replica(s) ({replicas.balancing}).")
+    if idempotency.IDEMPOTENCY_PURGE_INTERVAL_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(idempotency.purge_periodically()))
+    if inventory.INVENTORY_RECONCILE_INTERVAL_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(inventory.reconcile_periodically()))
 
     yield  # Application runs
 
-    # Clean up on shutdown (if any specific shutdown logic is needed)
     print("Application shutting down.")
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Clean up on shutdown: close pooled database connections
+    password_hasher.shutdown()
+    await engine.dispose()
+    await replicas.dispose()
+    # Stop reporting this worker's live gauges (multiprocess metrics mode only)
+    mark_process_dead()
 
 
 # Initialize FastAPI application with the lifespan context manager
@@ -44,6 +64,8 @@ app = FastAPI(
     description="A FastAPI backend for an e-commerce platform with user management, product inventory, order processing, JWT authentication, and Prometheus metrics.",
     version="1.0.0",
     lifespan=lifespan,  # Assign the lifespan context manager
+    # Encode responses that are not pre-serialized (errors, dicts) with orjson
+    default_response_class=ORJSONResponse,
 )
 
 # Add Prometheus middleware to collect HTTP request metrics
@@ -64,8 +86,10 @@ async def root():
 
 
 @app.get("/metrics", response_class=PlainTextResponse)
-async def metrics():
+def metrics():
     """
     Endpoint to expose Prometheus metrics.
+    Declared without `async` so FastAPI runs it in the threadpool: with several workers
+    it merges the metric files of all of them, which must not block the event loop.
     """
     return get_prometheus_metrics()
@@ -0,0 +1,77 @@
+# app/metrics/db_pool.py
+
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+from .prometheus_exporter import (
+    DB_POOL_CHECKOUT_WAIT_SECONDS,
+    DB_POOL_CHECKOUT_TIMEOUTS_TOTAL,
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_OVERFLOW,
+    DB_POOL_SIZE,
+)
+
+
+def _pool_label(pool: Pool) -> str:
+    """Metric label for a pool, taken from the engine's `pool_logging_name`."""
+    return pool.logging_name or "default"
+
+
+class InstrumentedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that records how long each checkout waited for a connection.
+    The wait includes opening a new connection when the pool has to grow.
+    """
+    def connect(self):
+        label = _pool_label(self)
+        start_time = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS_TOTAL.labels(engine=label).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT_SECONDS.labels(engine=label).observe(time.perf_counter() - start_time)
+
+
+def _update_pool_gauges(pool: Pool, returning: bool = False) -> None:
+    """
+    Publishes the pool's current occupancy to Prometheus.
+    The "checkin" event fires before the connection is handed back to the queue, so
+    when `returning` is set the connection being returned is accounted for here.
+    """
+    if not isinstance(pool, QueuePool):
+        return
+    label = _pool_label(pool)
+    checked_out = pool.checkedout()
+    overflow = pool.overflow()
+    if returning:
+        checked_out -= 1
+        if pool.checkedin() >= pool.size():
+            # The queue is full, so the returned connection is an overflow one and gets closed
+            overflow -= 1
+    DB_POOL_CHECKED_OUT.labels(engine=label).set(max(checked_out, 0))
+    DB_POOL_OVERFLOW.labels(engine=label).set(max(overflow, 0))
+    DB_POOL_SIZE.labels(engine=label).set(pool.size())
+
+
+def instrument_engine_pool(engine: AsyncEngine) -> None:
+    """
+    Registers pool event listeners that keep the occupancy gauges up to date.
+    The listeners are carried over when `engine.dispose()` recreates the pool,
+    so they always read the engine's current pool.
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine.pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        _update_pool_gauges(sync_engine.pool)
+
+    @event.listens_for(sync_engine.pool, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        _update_pool_gauges(sync_engine.pool, returning=True)
+
+    _update_pool_gauges(sync_engine.pool)
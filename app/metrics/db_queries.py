@@ -0,0 +1,131 @@
+# app/metrics/db_queries.py
+
+"""
+Per-request SQL statement accounting.
+
+`instrument_engine_queries` hooks the cursor execution events of an engine. While an
+HTTP request is being handled, `PrometheusMiddleware` keeps a `RequestQueries` in the
+`current_request_queries` context variable; the hooks add every statement, the time
+the database took to run it and the rows it returned (as far as the driver reports
+them, see `_returned_rows`) to it, and the middleware
+reports the totals per route when the request ends. Statements issued outside of a
+request (background tasks, scripts) are not counted.
+
+In development, DB_QUERY_GUARD flags requests that run the same statement again and
+again (an N+1 loop: one query per item instead of one for all of them) or that exceed
+a query budget:
+- "log": logs a warning with the route and the offending statement when the request
+  ends (logger `app.metrics.middleware`);
+- "raise": fails the statement that crosses the limit with `QueryGuardError`, so the
+  traceback points at the loop.
+Both count the request in `db_query_guard_violations_total`.
+"""
+
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..config import env_int
+
+# "off" (default), "log" or "raise"
+DB_QUERY_GUARD = os.getenv("DB_QUERY_GUARD", "off")
+
+# Statements a single request may execute before the guard flags it
+DB_QUERY_BUDGET = env_int("DB_QUERY_BUDGET", 20)
+
+# Executions of one statement within a request that count as an N+1 loop
+DB_QUERY_REPEAT_THRESHOLD = env_int("DB_QUERY_REPEAT_THRESHOLD", 5)
+
+if DB_QUERY_GUARD not in ("off", "log", "raise"):
+    raise ValueError(f"Unknown DB_QUERY_GUARD {DB_QUERY_GUARD!r}")
+
+
+class QueryGuardError(RuntimeError):
+    """A request repeated a statement or exceeded its query budget (DB_QUERY_GUARD=raise)."""
+
+
+@dataclass
+class RequestQueries:
+    """The SQL statements executed on behalf of one request."""
+    statements: int = 0
+    duration: float = 0.0 # Seconds spent in cursor execution
+    rows: int = 0
+    guarded: bool = True # False for requests exempted with `exempt_current_request`
+    # Executions per statement text. Statements are parameterized, so the text is the
+    # statement's shape and a loop issuing one query per item repeats the same one.
+    shapes: Counter = field(default_factory=Counter)
+    repeated: Optional[str] = None # First statement to reach DB_QUERY_REPEAT_THRESHOLD
+
+    def violations(self) -> List[str]:
+        """The guard's findings for this request: "repeated" and/or "budget"."""
+        if DB_QUERY_GUARD == "off" or not self.guarded:
+            return []
+        reasons = []
+        if self.repeated is not None:
+            reasons.append("repeated")
+        if self.statements > DB_QUERY_BUDGET:
+            reasons.append("budget")
+        return reasons
+
+
+current_request_queries: ContextVar[Optional[RequestQueries]] = ContextVar("current_request_queries", default=None)
+
+
+def exempt_current_request() -> None:
+    """
+    Excludes the current request from the query guard (its statements are still
+    measured), for endpoints that repeat a statement by design, such as batched imports.
+    """
+    queries = current_request_queries.get()
+    if queries is not None:
+        queries.guarded = False
+
+
+def _returned_rows(cursor) -> int:
+    # Best effort, from the DBAPI `rowcount`: asyncpg reports the size of the result
+    # set it fetched while executing. Server-side cursors used for streaming, and
+    # drivers that leave it at -1 for queries (SQLite), are not counted; statements
+    # without a result set return none.
+    if cursor.description is None or cursor.rowcount < 0:
+        return 0
+    return cursor.rowcount
+
+
+def instrument_engine_queries(engine: AsyncEngine) -> None:
+    """Registers the cursor execution hooks that attribute statements to the current request."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries = current_request_queries.get()
+        if queries is None:
+            return
+        queries.statements += 1
+        if DB_QUERY_GUARD != "off" and queries.guarded:
+            queries.shapes[statement] += 1
+            if queries.repeated is None and queries.shapes[statement] >= DB_QUERY_REPEAT_THRESHOLD:
+                queries.repeated = statement
+                if DB_QUERY_GUARD == "raise":
+                    raise QueryGuardError(
+                        f"Statement executed {DB_QUERY_REPEAT_THRESHOLD} times in one request "
+                        f"(N+1 query?): {statement}"
+                    )
+            if DB_QUERY_GUARD == "raise" and queries.statements > DB_QUERY_BUDGET:
+                raise QueryGuardError(f"Request exceeded its budget of {DB_QUERY_BUDGET} SQL statements")
+        # A connection executes one statement at a time
+        conn.info["query_start_time"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries = current_request_queries.get()
+        start_time = conn.info.pop("query_start_time", None)
+        if queries is None or start_time is None:
+            return
+        queries.duration += time.perf_counter() - start_time
+        queries.rows += _returned_rows(cursor)
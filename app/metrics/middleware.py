@@ -1,45 +1,161 @@
 # app/metrics/middleware.py
 
+import logging
 import time
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.routing import Match
-from prometheus_client import generate_latest
+from typing import Dict, Optional, Tuple
 
-from .prometheus_exporter import REQUESTS_TOTAL, REQUEST_DURATION_SECONDS
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
+from .db_queries import DB_QUERY_BUDGET, RequestQueries, current_request_queries
+from .prometheus_exporter import (
+    DB_QUERY_GUARD_VIOLATIONS_TOTAL,
+    DB_ROWS_PER_REQUEST,
+    DB_STATEMENTS_PER_REQUEST,
+    DB_TIME_PER_REQUEST_SECONDS,
+    REQUESTS_TOTAL,
+    REQUEST_DURATION_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    RESPONSE_SIZE_BYTES,
+)
+
+# Query guard reports (DB_QUERY_GUARD=log) are warnings of this logger
+logger = logging.getLogger(__name__)
+
+# Path label for requests that did not match any route (e.g. 404s), so that
+# arbitrary URLs cannot create unbounded label sets
+UNMATCHED_PATH = "<unmatched>"
+
+
+class PrometheusMiddleware:
     """
-    FastAPI middleware to collect HTTP request metrics for Prometheus.
-    It records total requests and request duration, categorized by method, path, and status code.
+    Pure ASGI middleware to collect HTTP request metrics for Prometheus.
+    It records total requests, request duration, response size and in-flight requests,
+    categorized by method, path template and status code, and the number of SQL
+    statements, database time and rows each request used (see `db_queries`).
+
+    The path template is read from the route the router already matched (FastAPI stores
+    it in the scope), or from an endpoint -> path table built once from the app's
+    routes, so no route matching is repeated here. Labelled metric children are cached
+    so `.labels()` is not called on every request.
     """
-    async def dispatch(self, request: Request, call_next):
-        method = request.method
-        path_template = self._get_path_template(request)
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._endpoint_paths: Optional[Dict[object, str]] = None
+        self._request_counters: Dict[Tuple[str, str, int], object] = {}
+        self._duration_histograms: Dict[Tuple[str, str], object] = {}
+        self._size_histograms: Dict[Tuple[str, str], object] = {}
+        self._in_flight_gauges: Dict[str, object] = {}
+        self._query_histograms: Dict[Tuple[str, str], Tuple[object, object, object]] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500 # Reported if the app raises before starting a response
+        response_size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = self._in_flight_gauges.get(method)
+        if in_flight is None:
+            in_flight = self._in_flight_gauges.setdefault(method, REQUESTS_IN_FLIGHT.labels(method=method))
+        in_flight.inc()
+
+        # Collect the SQL statements executed while handling the request
+        queries = RequestQueries()
+        queries_token = current_request_queries.set(queries)
 
         # Record request start time
-        start_time = time.time()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Record request duration
+            process_time = time.perf_counter() - start_time
+            current_request_queries.reset(queries_token)
+            in_flight.dec()
+            path = self._get_path_template(scope)
+            self._observe(method, path, status_code, process_time, response_size)
+            self._observe_queries(method, path, queries)
 
-        response = await call_next(request)
+    def _observe(self, method: str, path: str, status_code: int, duration: float, size: int) -> None:
+        """Updates the Prometheus metrics through cached label children."""
+        key = (method, path)
+        counter = self._request_counters.get((method, path, status_code))
+        if counter is None:
+            counter = REQUESTS_TOTAL.labels(method=method, path=path, status_code=status_code)
+            self._request_counters[(method, path, status_code)] = counter
+        duration_histogram = self._duration_histograms.get(key)
+        if duration_histogram is None:
+            duration_histogram = REQUEST_DURATION_SECONDS.labels(method=method, path=path)
+            self._duration_histograms[key] = duration_histogram
+        size_histogram = self._size_histograms.get(key)
+        if size_histogram is None:
+            size_histogram = RESPONSE_SIZE_BYTES.labels(method=method, path=path)
+            self._size_histograms[key] = size_histogram
 
-        # Record request duration
-        process_time = time.time() - start_time
+        counter.inc()
+        duration_histogram.observe(duration)
+        size_histogram.observe(size)
 
-        # Update Prometheus metrics
-        REQUESTS_TOTAL.labels(method=method, path=path_template, status_code=response.status_code).inc()
-        REQUEST_DURATION_SECONDS.labels(method=method, path=path_template).observe(process_time)
+    def _observe_queries(self, method: str, path: str, queries: RequestQueries) -> None:
+        """Records the request's SQL statements and reports it if the query guard flagged it."""
+        key = (method, path)
+        histograms = self._query_histograms.get(key)
+        if histograms is None:
+            histograms = (
+                DB_STATEMENTS_PER_REQUEST.labels(method=method, path=path),
+                DB_TIME_PER_REQUEST_SECONDS.labels(method=method, path=path),
+                DB_ROWS_PER_REQUEST.labels(method=method, path=path),
+            )
+            self._query_histograms[key] = histograms
+        statements_histogram, time_histogram, rows_histogram = histograms
+        statements_histogram.observe(queries.statements)
+        time_histogram.observe(queries.duration)
+        rows_histogram.observe(queries.rows)
 
-        return response
+        for reason in queries.violations():
+            DB_QUERY_GUARD_VIOLATIONS_TOTAL.labels(method=method, path=path, reason=reason).inc()
+            if reason == "repeated":
+                count = queries.shapes[queries.repeated]
+                logger.warning(
+                    "Query guard: %s %s executed a statement %d times (N+1 query?): %s", method, path, count, queries.repeated
+                )
+            else:
+                logger.warning(
+                    "Query guard: %s %s executed %d SQL statements (budget %d).", method, path, queries.statements, DB_QUERY_BUDGET
+                )
 
-    def _get_path_template(self, request: Request) -> str:
+    def _get_path_template(self, scope: Scope) -> str:
         """
-        Attempts to find the path template for the given request.
+        Returns the path template of the route that handled the request.
         This is important for grouping metrics by endpoint, not by specific URL parameters.
         """
-        for route in request.app.routes:
-            match, scope = route.matches(request.scope)
-            if match == Match.FULL:
-                return route.path
-        return request.url.path # Fallback to actual path if no route template found
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_PATH
+        if self._endpoint_paths is None:
+            self._endpoint_paths = self._build_endpoint_paths(scope)
+        return self._endpoint_paths.get(endpoint, UNMATCHED_PATH)
 
+    @staticmethod
+    def _build_endpoint_paths(scope: Scope) -> Dict[object, str]:
+        """Precomputes an endpoint -> path template table from the application's routes."""
+        app = scope.get("app")
+        routes = getattr(app, "routes", [])
+        return {
+            route.endpoint: route.path
+            for route in routes
+            if getattr(route, "endpoint", None) is not None and hasattr(route, "path")
+        }
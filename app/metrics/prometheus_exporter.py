@@ -1,6 +1,22 @@
 # app/metrics/prometheus_exporter.py
 
-from prometheus_client import Counter, Histogram, Gauge, generate_latest
+import os
+from typing import Optional
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, Gauge, generate_latest, multiprocess
+
+# Directory shared by all worker processes when the app runs with several workers.
+# prometheus_client switches to its multiprocess mode when this variable is set before
+# it is imported: every process writes its samples to mmap-backed files in the
+# directory, and /metrics merges them. The directory must be emptied before the
+# server (not each worker) starts, otherwise samples from a previous run are merged in.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+# In multiprocess mode a gauge needs to say how the values of the workers are combined.
+# "livesum"/"livemostrecent" only count processes that are still alive. Counters and
+# histograms are always summed, including the samples of workers that have exited.
 
 # Define custom metrics
 # Counter for total requests
@@ -17,32 +33,231 @@ REQUEST_DURATION_SECONDS = Histogram(
     ['method', 'path']
 )
 
+# Histograms for the SQL statements each request issued, the time the database took
+# to run them and the rows they returned (recorded by the cursor hooks in db_queries;
+# the row count is best effort, see `db_queries._returned_rows`)
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    'http_request_db_statements',
+    'SQL statements executed per HTTP request',
+    ['method', 'path'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20, 30, 50, 100, 200)
+)
+
+DB_TIME_PER_REQUEST_SECONDS = Histogram(
+    'http_request_db_duration_seconds',
+    'Time spent executing SQL statements per HTTP request in seconds',
+    ['method', 'path'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+DB_ROWS_PER_REQUEST = Histogram(
+    'http_request_db_rows',
+    'Rows returned by SQL statements per HTTP request (best effort: buffered results whose driver reports a row count)',
+    ['method', 'path'],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+)
+
+# Counter for requests flagged by the query guard, by reason ("repeated" or "budget")
+DB_QUERY_GUARD_VIOLATIONS_TOTAL = Counter(
+    'db_query_guard_violations_total',
+    'Requests that repeated a SQL statement or exceeded the query budget',
+    ['method', 'path', 'reason']
+)
+
+# Gauge for requests currently being processed
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'HTTP requests currently being processed',
+    ['method'],
+    multiprocess_mode='livesum'
+)
+
+# Histogram for response body size
+RESPONSE_SIZE_BYTES = Histogram(
+    'http_response_size_bytes',
+    'HTTP response body size in bytes',
+    ['method', 'path'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000)
+)
+
 # Gauge for CPU usage
 CPU_USAGE_PERCENT = Gauge(
     'system_cpu_usage_percent',
-    'Current system CPU usage in percent'
+    'Current system CPU usage in percent',
+    multiprocess_mode='livemostrecent' # Same value in every worker, report the latest
 )
 
 # Gauge for Memory usage
 MEMORY_USAGE_PERCENT = Gauge(
     'system_memory_usage_percent',
-    'Current system memory usage in percent'
+    'Current system memory usage in percent',
+    multiprocess_mode='livemostrecent'
 )
 
 # Gauge for process CPU usage (specific to the FastAPI process)
 PROCESS_CPU_USAGE_PERCENT = Gauge(
     'process_cpu_usage_percent',
-    'Current process CPU usage in percent'
+    'Current process CPU usage in percent',
+    multiprocess_mode='livesum' # Total across the worker processes
 )
 
 # Gauge for process Memory usage (specific to the FastAPI process)
 PROCESS_MEMORY_USAGE_BYTES = Gauge(
     'process_memory_usage_bytes',
-    'Current process memory usage in bytes'
+    'Current process memory usage in bytes',
+    multiprocess_mode='livesum'
+)
+
+# Histogram for time spent waiting to check a connection out of the DB pool
+DB_POOL_CHECKOUT_WAIT_SECONDS = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a database connection from the pool',
+    ['engine'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
 )
 
+# Counter for pool checkouts that gave up after pool_timeout
+DB_POOL_CHECKOUT_TIMEOUTS_TOTAL = Counter(
+    'db_pool_checkout_timeouts_total',
+    'Database connection checkouts that timed out waiting for the pool',
+    ['engine']
+)
+
+# Gauge for connections currently checked out of the pool
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections',
+    'Database connections currently checked out of the pool',
+    ['engine'],
+    multiprocess_mode='livesum'
+)
+
+# Gauge for connections opened beyond pool_size
+DB_POOL_OVERFLOW = Gauge(
+    'db_pool_overflow_connections',
+    'Database connections currently open beyond the configured pool size',
+    ['engine'],
+    multiprocess_mode='livesum'
+)
+
+# Gauge for the configured pool size
+DB_POOL_SIZE = Gauge(
+    'db_pool_size',
+    'Configured number of persistent database connections in the pool',
+    ['engine'],
+    multiprocess_mode='livesum' # Sum of the pools of all workers
+)
+
+# Gauge for password hash/verify calls queued or running in the worker pool
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    'password_hash_queue_depth',
+    'Password hashing operations queued or running',
+    multiprocess_mode='livesum'
+)
+
+# Histogram for password hash/verify latency, including time spent queued
+PASSWORD_HASH_DURATION_SECONDS = Histogram(
+    'password_hash_duration_seconds',
+    'Password hashing operation latency in seconds',
+    ['operation'],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0, 10.0)
+)
+
+# Counter for password hash/verify calls rejected because the queue was full
+PASSWORD_HASH_REJECTED_TOTAL = Counter(
+    'password_hash_rejected_total',
+    'Password hashing operations rejected because the queue was full',
+    ['operation']
+)
+
+# Counter for product cache lookups by result (hit or miss)
+PRODUCT_CACHE_REQUESTS_TOTAL = Counter(
+    'product_cache_requests_total',
+    'Product cache lookups',
+    ['result']
+)
+
+# Gauge for the replication lag last measured on each read replica
+DB_REPLICA_LAG_SECONDS = Gauge(
+    'db_replica_lag_seconds',
+    'Replication lag of a read replica in seconds, as last measured',
+    ['engine'],
+    multiprocess_mode='livemax' # Workers measure independently; report the worst
+)
+
+# Gauge for whether a read replica currently receives reads (1) or is skipped (0)
+DB_REPLICA_AVAILABLE = Gauge(
+    'db_replica_available',
+    'Whether a read replica is reachable and within the allowed lag',
+    ['engine'],
+    multiprocess_mode='livemin' # Skipped by any worker counts as skipped
+)
+
+# Counter for read-only sessions by the engine that served them ("primary" on fallback)
+DB_READ_SESSIONS_TOTAL = Counter(
+    'db_read_sessions_total',
+    'Read-only database sessions by the engine that served them',
+    ['engine']
+)
+
+# Registry that merges the files of all worker processes on every collection.
+# Built once; the collector re-reads the directory each time it is scraped.
+_multiprocess_registry: Optional[CollectorRegistry] = None
+if PROMETHEUS_MULTIPROC_DIR:
+    _multiprocess_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(_multiprocess_registry, path=PROMETHEUS_MULTIPROC_DIR)
+
 # Function to generate Prometheus metrics in text format
 def get_prometheus_metrics():
-    """Generates the latest Prometheus metrics in text format."""
+    """
+    Generates the latest Prometheus metrics in text format.
+    In multiprocess mode the samples of every worker are merged; this reads files, so
+    call it off the event loop.
+    """
+    if _multiprocess_registry is not None:
+        return generate_latest(_multiprocess_registry).decode('utf-8')
     return generate_latest().decode('utf-8')
 
+def mark_process_dead(pid: Optional[int] = None) -> None:
+    """
+    Removes the live gauge files of an exited worker so its last values stop being
+    reported (no-op outside multiprocess mode). Defaults to the current process.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid(), path=PROMETHEUS_MULTIPROC_DIR)
+
+
+# Gauge for order jobs by state (queued, dead), measured by the order workers
+ORDER_QUEUE_DEPTH = Gauge(
+    'order_queue_depth',
+    'Order jobs waiting to be processed (queued) or failed for good (dead)',
+    ['state'],
+    multiprocess_mode='livemax' # Every worker measures the same table
+)
+
+# Gauge for how long the oldest due job has been waiting
+ORDER_QUEUE_LAG_SECONDS = Gauge(
+    'order_queue_lag_seconds',
+    'Seconds the oldest due order job has been waiting to be processed',
+    multiprocess_mode='livemax'
+)
+
+# Counter for order job attempts by outcome ("done", "retry" or "dead")
+ORDER_JOBS_TOTAL = Counter(
+    'order_jobs_total',
+    'Order job attempts by outcome',
+    ['outcome']
+)
+
+# Histogram for the time from order submission until its job was processed
+ORDER_JOB_LATENCY_SECONDS = Histogram(
+    'order_job_latency_seconds',
+    'Time from order submission until its job finished, in seconds',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+)
+
+# Histogram for the number of jobs a worker claimed at once
+ORDER_JOB_BATCH_SIZE = Histogram(
+    'order_job_batch_size',
+    'Order jobs claimed per batch',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
@@ -1,10 +1,23 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, Date, DateTime, ForeignKey, Boolean, Index, LargeBinary, CheckConstraint, DDL, event, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 
+# Trigram indexes need the pg_trgm extension; create it along with the schema
+# (migrations create it explicitly, see migrations/versions)
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+
+# Full-text document of a product: the name weighs more than the description. It is
+# not stored: the GIN index is built on this expression, and searches must use it
+# verbatim to be served by the index.
+PRODUCT_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
 # User Model
 class User(Base):
     """
@@ -41,9 +54,14 @@ class Product(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=False)
+    sku = Column(String, unique=True, index=True, nullable=True) # Stock keeping unit, matches rows on bulk import
     description = Column(String, nullable=True)
     price = Column(Float, nullable=False)
     quantity = Column(Integer, default=0)  # Inventory quantity
+    # Number of inventory shards holding the stock of a hot product (0: not sharded).
+    # When sharded, `quantity` is a copy of the shards' total kept up to date by the
+    # inventory reconciler (see `app.inventory`).
+    stock_shards = Column(SmallInteger, nullable=False, default=0, server_default="0")
     buying_price = Column(Float, nullable=False) # Cost to acquire the product
     selling_price = Column(Float, nullable=False) # Price at which it's sold
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -52,6 +70,15 @@ class Product(Base):
     # Relationship to order items that include this product
     order_items = relationship("OrderItem", back_populates="product")
 
+    # Full-text search over name and description, and trigram matching on the name
+    # for typo-tolerant and prefix search (see `queries.products.search_products`)
+    __table_args__ = (
+        Index("ix_products_search_document", text(f"({PRODUCT_SEARCH_DOCUMENT})"), postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index(
+            "ix_products_name_trgm", name, postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+
     def __repr__(self):
         return f"<Product(id={self.id}, name='{self.name}', price={self.price})>"
 
@@ -66,7 +93,7 @@ class Order(Base):
     id = Column(Integer, primary_key=True, index=True)
     buyer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     total_amount = Column(Float, nullable=False)
-    status = Column(String, default="pending") # e.g., pending, completed, cancelled
+    status = Column(String, default="pending") # pending (queued), confirmed, shipped, completed or cancelled (`schemas.OrderStatus`)
     shipping_address = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -76,6 +103,15 @@ class Order(Base):
     # Relationship to the items within this order
     items = relationship("OrderItem", back_populates="order")
 
+    # Indexes backing keyset pagination (newest first) for all orders and per buyer,
+    # plus status filters. The buyer index also serves foreign-key lookups on buyer_id.
+    # Created by migrations (see migrations/versions), not at application startup.
+    __table_args__ = (
+        Index("ix_orders_created_at_id", created_at.desc(), id.desc()),
+        Index("ix_orders_buyer_id_created_at_id", buyer_id, created_at.desc(), id.desc()),
+        Index("ix_orders_status_created_at", status, created_at.desc()),
+    )
+
     def __repr__(self):
         return f"<Order(id={self.id}, buyer_id={self.buyer_id}, total_amount={self.total_amount})>"
 
@@ -98,6 +134,197 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
 
+    # Foreign-key indexes for loading an order's items and a product's sales
+    __table_args__ = (
+        Index("ix_order_items_order_id", order_id),
+        Index("ix_order_items_product_id", product_id),
+    )
+
     def __repr__(self):
         return f"<OrderItem(id={self.id}, order_id={self.order_id}, product_id={self.product_id}, quantity={self.quantity})>"
 
+
+# IdempotencyKey Model
+class IdempotencyKey(Base):
+    """
+    SQLAlchemy model for an `Idempotency-Key` sent with `POST /orders/`.
+    Inserted in the transaction that creates the order, together with the response,
+    so a retried request gets the stored response instead of a second order.
+    Rows older than IDEMPOTENCY_KEY_TTL_HOURS are purged (see `app.idempotency`).
+    """
+    __tablename__ = "idempotency_keys"
+
+    buyer_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False) # SHA-256 of the request body, to detect key reuse
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="SET NULL"), nullable=True)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    # Serves the purge of expired keys
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", created_at),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey(buyer_id={self.buyer_id}, key='{self.key}', order_id={self.order_id})>"
+
+# --- Sales aggregates ---
+# Maintained incrementally by `app.aggregates` in the transaction that creates an order,
+# and rebuilt from the order history by `python -m app.aggregates`.
+
+# UserOrderStats Model
+class UserOrderStats(Base):
+    """
+    SQLAlchemy model for a user's order totals (one row per user who has ordered).
+    """
+    __tablename__ = "user_order_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    total_spent = Column(Float, nullable=False, default=0.0) # Sum of the orders' total_amount
+    first_order_at = Column(DateTime(timezone=True), nullable=True)
+    last_order_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<UserOrderStats(user_id={self.user_id}, order_count={self.order_count}, total_spent={self.total_spent})>"
+
+# ProductSalesStats Model
+class ProductSalesStats(Base):
+    """
+    SQLAlchemy model for a product's sales totals (one row per product that has sold,
+    or one per bucket for products with inventory shards).
+    Revenue is taken from `price_at_purchase`, cost from the product's `buying_price`.
+    """
+    __tablename__ = "product_sales_stats"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    # Sales of a product with inventory shards are spread over as many bucket rows
+    # (`order id % stock_shards`), so its concurrent orders do not queue on one row;
+    # other products only have bucket 0. Readers add up a product's buckets.
+    bucket = Column(SmallInteger, primary_key=True, default=0)
+    units_sold = Column(Integer, nullable=False, default=0)
+    order_count = Column(Integer, nullable=False, default=0) # Orders containing the product
+    revenue = Column(Float, nullable=False, default=0.0)
+    cost = Column(Float, nullable=False, default=0.0)
+    last_sold_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<ProductSalesStats(product_id={self.product_id}, units_sold={self.units_sold}, revenue={self.revenue})>"
+
+# DailyRevenue Model
+class DailyRevenue(Base):
+    """
+    SQLAlchemy model for the sales of one day (UTC), split over a few bucket rows.
+    Every order of the day would otherwise update the same row and wait for the
+    previous order's transaction to release it; an order only updates the bucket
+    `order id % DAILY_REVENUE_BUCKETS`, and readers add up a day's buckets.
+    """
+    __tablename__ = "daily_revenue"
+
+    day = Column(Date, primary_key=True)
+    bucket = Column(SmallInteger, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    units_sold = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    cost = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DailyRevenue(day={self.day}, bucket={self.bucket}, revenue={self.revenue})>"
+
+# --- Inventory ---
+# Stock of hot products split over shards, and time-limited stock reservations.
+# See `app.inventory`.
+
+# InventoryShard Model
+class InventoryShard(Base):
+    """
+    SQLAlchemy model for a share of a hot product's stock.
+    A checkout decrements one shard picked at random among those not locked by
+    another checkout, so up to `stock_shards` checkouts of the product run at once
+    instead of queueing on `products.quantity`.
+    """
+    __tablename__ = "inventory_shards"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(SmallInteger, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        CheckConstraint("quantity >= 0", name="ck_inventory_shards_quantity"),
+    )
+
+    def __repr__(self):
+        return f"<InventoryShard(product_id={self.product_id}, shard={self.shard}, quantity={self.quantity})>"
+
+# InventoryReservation Model
+class InventoryReservation(Base):
+    """
+    SQLAlchemy model for stock held for a buyer until `expires_at`.
+    The stock is deducted when the reservation is made; an order that references the
+    reservation takes it over, and the reconciler returns the stock of reservations
+    that expired unused.
+    """
+    __tablename__ = "inventory_reservations"
+
+    id = Column(Integer, primary_key=True)
+    buyer_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    items = relationship("InventoryReservationItem", cascade="all, delete-orphan", passive_deletes=True)
+
+    # Serves the expiry of reservations
+    __table_args__ = (
+        Index("ix_inventory_reservations_expires_at", expires_at),
+    )
+
+    def __repr__(self):
+        return f"<InventoryReservation(id={self.id}, buyer_id={self.buyer_id}, expires_at={self.expires_at})>"
+
+# InventoryReservationItem Model
+class InventoryReservationItem(Base):
+    """
+    SQLAlchemy model for the quantity of one product held by a reservation.
+    """
+    __tablename__ = "inventory_reservation_items"
+
+    reservation_id = Column(Integer, ForeignKey("inventory_reservations.id", ondelete="CASCADE"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<InventoryReservationItem(reservation_id={self.reservation_id}, product_id={self.product_id}, quantity={self.quantity})>"
+
+# --- Order Queue ---
+
+# OrderJob Model
+class OrderJob(Base):
+    """
+    SQLAlchemy model for the processing of an order accepted in queued intake mode.
+    The API records the order as `pending` with a queued job; `app.worker` processes
+    it (deducts the stock, updates the sales aggregates), marks it `done` and confirms
+    the order. A job that fails permanently, or too many times, is `dead` and its order
+    cancelled.
+    """
+    __tablename__ = "order_jobs"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, unique=True)
+    state = Column(String(16), nullable=False, default="queued") # queued, done or dead
+    payload = Column(LargeBinary, nullable=False) # The `OrderCreate` request as JSON
+    attempts = Column(Integer, nullable=False, default=0) # Failed attempts so far
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now()) # Retry backoff
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Serves the workers' claims (queued jobs that are due, oldest first) and the
+    # queue depth per state
+    __table_args__ = (
+        Index("ix_order_jobs_state_run_after_id", state, run_after, id),
+    )
+
+    def __repr__(self):
+        return f"<OrderJob(id={self.id}, order_id={self.order_id}, state={self.state}, attempts={self.attempts})>"
@@ -0,0 +1,74 @@
+# app/pagination.py
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+# Response header carrying the cursor of the next page for list endpoints.
+# List bodies stay plain JSON arrays so offset-based clients keep working.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encodes the sort-key values of the last row of a page as an opaque token."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence[InstrumentedAttribute]) -> List[Any]:
+    """
+    Decodes a cursor produced by `encode_cursor` for the given sort columns.
+    Raises HTTPException (400) if the token is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("cursor does not match the sort key")
+        return [
+            datetime.fromisoformat(value) if column.type.python_type is datetime else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError, UnicodeError, NotImplementedError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+def keyset_paginate(
+    stmt: Select,
+    columns: Sequence[InstrumentedAttribute],
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    descending: bool = False,
+) -> Select:
+    """
+    Applies a stable sort on `columns` plus either a keyset condition (when a cursor is
+    given) or the legacy offset. The sort columns must be unique together and backed by
+    an index for the keyset path to stay constant-time at any depth.
+    """
+    order_by = [column.desc() if descending else column.asc() for column in columns]
+    stmt = stmt.order_by(*order_by).limit(limit)
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        key = tuple_(*columns) if len(columns) > 1 else columns[0]
+        bound = tuple_(*values) if len(columns) > 1 else values[0]
+        return stmt.where(key < bound if descending else key > bound)
+    return stmt.offset(skip)
+
+
+def next_cursor(items: Sequence[Any], limit: int, key: Callable[[Any], Sequence[Any]]) -> Optional[str]:
+    """Returns the cursor for the page after `items`, or None if this was the last page."""
+    if not items or len(items) < limit:
+        return None
+    return encode_cursor(key(items[-1]))
+
+
+def next_cursor_headers(items: Sequence[Any], limit: int, key: Callable[[Any], Sequence[Any]]) -> Dict[str, str]:
+    """Response headers exposing the cursor of the next page (empty on the last page)."""
+    token = next_cursor(items, limit, key)
+    return {NEXT_CURSOR_HEADER: token} if token else {}
@@ -0,0 +1,109 @@
+# app/passwords.py
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from .config import env_int
+from .metrics.prometheus_exporter import (
+    PASSWORD_HASH_DURATION_SECONDS,
+    PASSWORD_HASH_QUEUE_DEPTH,
+    PASSWORD_HASH_REJECTED_TOTAL,
+)
+
+# bcrypt cost factor for new hashes. Existing hashes with a different cost are
+# transparently re-hashed the next time their owner logs in.
+BCRYPT_ROUNDS = env_int("BCRYPT_ROUNDS", 12)
+
+# Number of worker processes doing bcrypt work (0 runs it on a single thread in
+# this process, which is only meant for development).
+PASSWORD_HASH_WORKERS = env_int("PASSWORD_HASH_WORKERS", os.cpu_count() or 1)
+
+# Hash/verify calls allowed to be queued or running at once; anything beyond
+# this is rejected immediately with 503 instead of piling up behind the pool.
+PASSWORD_HASH_MAX_PENDING = env_int("PASSWORD_HASH_MAX_PENDING", max(PASSWORD_HASH_WORKERS, 1) * 4)
+
+# Password hashing context (also created in every worker process)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def _hash_password(password: str) -> str:
+    """Hashes a plain password (runs in a worker process)."""
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password and returns a replacement hash when the stored one is outdated
+    (runs in a worker process).
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded pool of worker processes,
+    so a burst of logins or registrations cannot starve the event loop.
+    """
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                # "spawn" keeps the workers from inheriting the event loop and open sockets
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    async def _run(self, operation: str, func, *args):
+        if self._pending >= self.max_pending:
+            PASSWORD_HASH_REJECTED_TOTAL.labels(operation=operation).inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        PASSWORD_HASH_QUEUE_DEPTH.set(self._pending)
+        start_time = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+            PASSWORD_HASH_QUEUE_DEPTH.set(self._pending)
+            PASSWORD_HASH_DURATION_SECONDS.labels(operation=operation).observe(time.perf_counter() - start_time)
+
+    async def hash(self, password: str) -> str:
+        """Hashes a plain password with the configured bcrypt cost."""
+        return await self._run("hash", _hash_password, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifies a password against its hash.
+        Returns (valid, new_hash); `new_hash` is set when the stored hash needs an upgrade.
+        """
+        return await self._run("verify", _verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        """Stops the worker pool (called on application shutdown)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Shared hasher used by the auth and CRUD layers
+password_hasher = PasswordHasher()
@@ -0,0 +1 @@
+# app/queries/__init__.py
@@ -0,0 +1,79 @@
+# app/queries/aggregates.py
+
+from datetime import date
+from typing import Sequence, Union
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from .columns import columns_for
+
+# Columns of `UserOrderStatsResponse`
+USER_ORDER_STATS_COLUMNS = columns_for(models.UserOrderStats, schemas.UserOrderStatsResponse)
+
+
+def _product_sales_column(name: str):
+    ProductSalesStats = models.ProductSalesStats
+    if name == "product_id":
+        return ProductSalesStats.product_id
+    if name == "last_sold_at":
+        return func.max(ProductSalesStats.last_sold_at).label(name)
+    if name == "margin":
+        return (func.sum(ProductSalesStats.revenue) - func.sum(ProductSalesStats.cost)).label(name)
+    return func.sum(getattr(ProductSalesStats, name)).label(name)
+
+
+# Columns of `ProductSalesResponse`, added up over the product's bucket rows, with the
+# margin derived from revenue and cost
+PRODUCT_SALES_COLUMNS = tuple(_product_sales_column(name) for name in schemas.ProductSalesResponse.model_fields)
+
+
+def _zero(schema, **keys) -> dict:
+    """Defaults of an aggregate response, for keys that have no row yet."""
+    return schema(**keys).model_dump()
+
+
+async def get_user_order_stats(db: AsyncSession, user_id: int) -> Union[Row, dict]:
+    """Retrieve a user's order totals (a primary key lookup)."""
+    stmt = select(*USER_ORDER_STATS_COLUMNS).where(models.UserOrderStats.user_id == user_id)
+    row = (await db.execute(stmt)).first()
+    return row if row is not None else _zero(schemas.UserOrderStatsResponse, user_id=user_id)
+
+
+async def get_product_sales(db: AsyncSession, product_id: int) -> Union[Row, dict]:
+    """Retrieve a product's sales totals (a primary key range scan over its bucket rows)."""
+    stmt = (
+        select(*PRODUCT_SALES_COLUMNS)
+        .where(models.ProductSalesStats.product_id == product_id)
+        .group_by(models.ProductSalesStats.product_id)
+    )
+    row = (await db.execute(stmt)).first()
+    return row if row is not None else _zero(schemas.ProductSalesResponse, product_id=product_id)
+
+
+async def list_daily_revenue(
+    db: AsyncSession, start: date, end: date
+) -> Sequence[Row]:
+    """
+    Retrieve the sales of each day in `[start, end]` that had orders, oldest first.
+    Reads the day's bucket rows (a primary key range scan) and adds them up, so the
+    cost depends on the number of days, not on the number of orders.
+    """
+    DailyRevenue = models.DailyRevenue
+    revenue, cost = func.sum(DailyRevenue.revenue), func.sum(DailyRevenue.cost)
+    stmt = (
+        select(
+            func.sum(DailyRevenue.units_sold).label("units_sold"),
+            func.sum(DailyRevenue.order_count).label("order_count"),
+            revenue.label("revenue"),
+            cost.label("cost"),
+            (revenue - cost).label("margin"),
+            DailyRevenue.day,
+        )
+        .where(DailyRevenue.day >= start, DailyRevenue.day <= end)
+        .group_by(DailyRevenue.day)
+        .order_by(DailyRevenue.day)
+    )
+    return (await db.execute(stmt)).all()
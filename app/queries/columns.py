@@ -0,0 +1,21 @@
+# app/queries/columns.py
+
+from typing import Iterable, Tuple, Type
+
+from pydantic import BaseModel
+from sqlalchemy.orm import InstrumentedAttribute
+
+
+def columns_for(
+    model: type, schema: Type[BaseModel], exclude: Iterable[str] = ()
+) -> Tuple[InstrumentedAttribute, ...]:
+    """
+    Returns the model columns behind the fields of a response schema, in field order.
+    Read queries select exactly these, so their rows serialize to the same JSON as
+    the schema, and columns the API never returns (such as `hashed_password`) are
+    not fetched.
+    """
+    excluded = set(exclude)
+    return tuple(
+        getattr(model, name) for name in schema.model_fields if name not in excluded
+    )
@@ -0,0 +1,132 @@
+# app/queries/orders.py
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload, selectinload
+
+from .. import models, schemas
+from ..pagination import keyset_paginate
+from .columns import columns_for
+
+# Stable sort key for order listings (newest first), backed by the orders indexes
+ORDER_SORT_KEY = (models.Order.created_at, models.Order.id)
+
+
+def _item_loading(include_items: bool):
+    """
+    Loader option for `Order.items`.
+    Items are fetched with one batched `WHERE order_id IN (...)` query per page instead
+    of being joined into the paged query, which would repeat every order row once per
+    item and force the LIMIT into a subquery. Summaries refuse to load items at all.
+    """
+    return selectinload(models.Order.items) if include_items else raiseload(models.Order.items)
+
+
+async def list_orders(
+    db: AsyncSession,
+    buyer_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_items: bool = True,
+) -> List[models.Order]:
+    """
+    Retrieve a page of orders, newest first, optionally restricted to one buyer.
+    The page of parent orders is selected first; with `include_items` their items are
+    loaded in a single extra query, otherwise only the order rows are read.
+    """
+    stmt = select(models.Order).options(_item_loading(include_items))
+    if buyer_id is not None:
+        stmt = stmt.where(models.Order.buyer_id == buyer_id)
+    stmt = keyset_paginate(
+        stmt, ORDER_SORT_KEY, cursor=cursor, skip=skip, limit=limit, descending=True
+    )
+    result = await db.scalars(stmt)
+    return list(result.all())
+
+
+async def get_order(db: AsyncSession, order_id: int) -> Optional[models.Order]:
+    """Retrieve a single order together with its items."""
+    return await db.scalar(
+        select(models.Order)
+        .options(_item_loading(True))
+        .where(models.Order.id == order_id)
+    )
+
+
+# --- Column-projected reads (used by the GET endpoints) ---
+
+# Columns of `OrderSummaryResponse` / `OrderItemResponse`
+ORDER_COLUMNS = columns_for(models.Order, schemas.OrderSummaryResponse)
+ORDER_ITEM_COLUMNS = columns_for(models.OrderItem, schemas.OrderItemResponse)
+
+
+@dataclass(slots=True)
+class OrderRow:
+    """An order read as plain columns together with its item rows (`OrderResponse`)."""
+    shipping_address: str
+    id: int
+    buyer_id: int
+    total_amount: float
+    status: str
+    created_at: datetime
+    updated_at: Optional[datetime]
+    items: List[Dict[str, Any]] = field(default_factory=list)
+
+
+async def _attach_items(db: AsyncSession, rows: Sequence[Row]) -> List[OrderRow]:
+    """Loads the items of a page of order rows with one `WHERE order_id IN` query."""
+    orders = [OrderRow(**row._mapping) for row in rows]
+    if not orders:
+        return orders
+    by_id = {order.id: order for order in orders}
+    result = await db.execute(
+        select(*ORDER_ITEM_COLUMNS)
+        .where(models.OrderItem.order_id.in_(list(by_id)))
+        .order_by(models.OrderItem.order_id, models.OrderItem.id)
+    )
+    # Items are kept as plain dicts built from the column keys fetched once: a page
+    # holds thousands of them, and converting each Row when serializing costs more
+    keys = tuple(result.keys())
+    for values in result.tuples():
+        item = dict(zip(keys, values))
+        by_id[item["order_id"]].items.append(item)
+    return orders
+
+
+async def list_order_rows(
+    db: AsyncSession,
+    buyer_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_items: bool = True,
+) -> Sequence[Union[OrderRow, Row]]:
+    """
+    Column-projected variant of `list_orders`: the same page of orders, newest first,
+    read as rows without ORM entities or identity-map bookkeeping. Returns `OrderRow`s
+    with their items, or bare summary rows when `include_items` is False.
+    """
+    stmt = select(*ORDER_COLUMNS)
+    if buyer_id is not None:
+        stmt = stmt.where(models.Order.buyer_id == buyer_id)
+    stmt = keyset_paginate(
+        stmt, ORDER_SORT_KEY, cursor=cursor, skip=skip, limit=limit, descending=True
+    )
+    rows = (await db.execute(stmt)).all()
+    return await _attach_items(db, rows) if include_items else rows
+
+
+async def get_order_row(db: AsyncSession, order_id: int) -> Optional[OrderRow]:
+    """Column-projected variant of `get_order`."""
+    row = (
+        await db.execute(select(*ORDER_COLUMNS).where(models.Order.id == order_id))
+    ).first()
+    if row is None:
+        return None
+    return (await _attach_items(db, [row]))[0]
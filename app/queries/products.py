@@ -0,0 +1,96 @@
+# app/queries/products.py
+
+from typing import Optional, Sequence
+
+from sqlalchemy import Float, and_, func, literal, literal_column, or_, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..pagination import decode_cursor, keyset_paginate
+from .columns import columns_for
+
+# Columns of `ProductResponse`
+PRODUCT_COLUMNS = columns_for(models.Product, schemas.ProductResponse)
+
+# Stable sort key for the catalog, backed by the primary key
+PRODUCT_SORT_KEY = (models.Product.id,)
+
+# The full-text document, inlined exactly as the GIN index was built on it: bound
+# parameters (e.g. for 'english') would keep the planner from matching the index
+PRODUCT_SEARCH_DOCUMENT = literal_column(f"({models.PRODUCT_SEARCH_DOCUMENT})", type_=TSVECTOR)
+
+
+async def list_products(
+    db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+) -> Sequence[Row]:
+    """Retrieve a page of the catalog as `ProductResponse` rows, ordered by ID."""
+    stmt = keyset_paginate(
+        select(*PRODUCT_COLUMNS),
+        PRODUCT_SORT_KEY,
+        cursor=cursor,
+        skip=skip,
+        limit=limit,
+    )
+    return (await db.execute(stmt)).all()
+
+
+async def get_product(db: AsyncSession, product_id: int) -> Optional[Row]:
+    """Retrieve a single product as a `ProductResponse` row."""
+    stmt = select(*PRODUCT_COLUMNS).where(models.Product.id == product_id)
+    return (await db.execute(stmt)).first()
+
+
+def _search_match(dialect_name: str, q: str):
+    """
+    Returns the match condition and the rank expression of a search for `q`.
+    On PostgreSQL a product matches when its full-text document matches the query
+    (stemmed words, AND/OR/-/"phrase" web search syntax), served by the GIN expression
+    index on the document, or when `q` is similar to a word sequence of the name (typos,
+    unfinished words), served by the trigram index. Full-text relevance and name
+    similarity add up to the rank. Elsewhere (SQLite) it is a substring match, unranked.
+    """
+    Product = models.Product
+    if dialect_name != "postgresql":
+        pattern = f"%{q}%"
+        return or_(Product.name.ilike(pattern), Product.description.ilike(pattern)), literal(0.0, Float)
+    query = func.websearch_to_tsquery("english", q)
+    # `name %> q`: word_similarity(q, name) reaches pg_trgm.word_similarity_threshold
+    condition = or_(PRODUCT_SEARCH_DOCUMENT.op("@@")(query), Product.name.op("%>")(q))
+    rank = func.ts_rank_cd(PRODUCT_SEARCH_DOCUMENT, query, type_=Float) + func.word_similarity(q, Product.name, type_=Float)
+    return condition, rank
+
+
+async def search_products(
+    db: AsyncSession,
+    q: str,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: bool = False,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> Sequence[Row]:
+    """
+    Search the catalog; returns `ProductSearchResult` rows, best match first.
+    Pages are ordered by (rank DESC, id) and continued with a keyset cursor on the two.
+    The rank is computed per matching product, so the cost of a page grows with the
+    number of matches (kept low by the filters) rather than with the catalog.
+    """
+    condition, rank = _search_match(db.get_bind().dialect.name, q)
+    rank = rank.label("rank")
+    stmt = select(*PRODUCT_COLUMNS, rank).where(condition)
+    if min_price is not None:
+        stmt = stmt.where(models.Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(models.Product.price <= max_price)
+    if in_stock:
+        stmt = stmt.where(models.Product.quantity > 0)
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, (rank, models.Product.id))
+        rank_value = rank.element # The expression, as a label cannot be compared in WHERE
+        stmt = stmt.where(
+            or_(rank_value < last_rank, and_(rank_value == last_rank, models.Product.id > last_id))
+        )
+    stmt = stmt.order_by(rank.desc(), models.Product.id).limit(limit)
+    return (await db.execute(stmt)).all()
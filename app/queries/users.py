@@ -0,0 +1,33 @@
+# app/queries/users.py
+
+from typing import Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..pagination import keyset_paginate
+from .columns import columns_for
+
+# Columns of `UserResponse`; the password hash is never read on these paths
+USER_COLUMNS = columns_for(models.User, schemas.UserResponse)
+
+# Stable sort key for user listings, backed by the primary key
+USER_SORT_KEY = (models.User.id,)
+
+
+async def list_users(
+    db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+) -> Sequence[Row]:
+    """Retrieve a page of users as `UserResponse` rows, ordered by ID."""
+    stmt = keyset_paginate(
+        select(*USER_COLUMNS), USER_SORT_KEY, cursor=cursor, skip=skip, limit=limit
+    )
+    return (await db.execute(stmt)).all()
+
+
+async def get_user(db: AsyncSession, user_id: int) -> Optional[Row]:
+    """Retrieve a single user as a `UserResponse` row."""
+    stmt = select(*USER_COLUMNS).where(models.User.id == user_id)
+    return (await db.execute(stmt)).first()
@@ -0,0 +1,130 @@
+# app/replicas.py
+
+"""
+Read-replica routing.
+
+Read-only endpoints take their session from `database.get_read_db`, which asks the
+`ReplicaSet` for a replica and falls back to the primary when none is configured or
+available. Writes, and reads that must see a write just made (the response of a
+create or update), keep using `database.get_db` and therefore the primary.
+
+A background task measures every replica's replication lag; a replica that is
+unreachable or further behind than DB_REPLICA_MAX_LAG_SECONDS stops receiving reads
+until it catches up.
+"""
+
+import asyncio
+import itertools
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from .config import env_float
+from .metrics.prometheus_exporter import DB_REPLICA_AVAILABLE, DB_REPLICA_LAG_SECONDS
+
+# How reads are spread over the available replicas: "round_robin" or "least_connections"
+# (the replica with the fewest sessions open in this process)
+DB_REPLICA_BALANCING = os.getenv("DB_REPLICA_BALANCING", "round_robin")
+
+# Replicas further behind the primary than this stop receiving reads
+DB_REPLICA_MAX_LAG_SECONDS = env_float("DB_REPLICA_MAX_LAG_SECONDS", 5.0)
+
+# Seconds between lag measurements, and how long a measurement may take
+DB_REPLICA_CHECK_INTERVAL = env_float("DB_REPLICA_CHECK_INTERVAL", 1.0)
+DB_REPLICA_CHECK_TIMEOUT = env_float("DB_REPLICA_CHECK_TIMEOUT", 1.0)
+
+# Seconds since the last replayed transaction, or 0 when the replica has replayed
+# everything it received (an idle primary would otherwise look like lag). A server
+# that is not in recovery (e.g. a promoted replica) has no lag.
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery()"
+    " OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+@dataclass
+class Replica:
+    """A read replica's engine, session factory and routing state (per process)."""
+    name: str
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker
+    available: bool = True
+    lag: Optional[float] = None # Seconds, as last measured
+    in_flight: int = 0 # Sessions currently open on this replica
+
+
+class ReplicaSet:
+    """
+    Chooses the replica for each read-only session.
+    Replicas are assumed available until the first lag check says otherwise.
+    """
+    def __init__(self, engines: List[AsyncEngine], balancing: str = DB_REPLICA_BALANCING):
+        if balancing not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown DB_REPLICA_BALANCING {balancing!r}")
+        self.balancing = balancing
+        self.replicas = [
+            Replica(
+                name=engine.sync_engine.pool.logging_name or f"replica{index}",
+                engine=engine,
+                sessionmaker=async_sessionmaker(
+                    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+                ),
+            )
+            for index, engine in enumerate(engines)
+        ]
+        self._turns = itertools.count()
+
+    def acquire(self) -> Optional[Replica]:
+        """Picks a replica for a new session, or None to use the primary. Pair with `release`."""
+        candidates = [replica for replica in self.replicas if replica.available]
+        if not candidates:
+            return None
+        # Rotating the starting point also breaks ties between equally loaded replicas
+        start = next(self._turns) % len(candidates)
+        candidates = candidates[start:] + candidates[:start]
+        replica = candidates[0] if self.balancing == "round_robin" else min(candidates, key=lambda r: r.in_flight)
+        replica.in_flight += 1
+        return replica
+
+    def release(self, replica: Replica) -> None:
+        replica.in_flight -= 1
+
+    async def _measure_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            if conn.dialect.name != "postgresql":
+                await conn.execute(text("SELECT 1")) # No replication to measure (e.g. SQLite stand-ins)
+                return 0.0
+            return float((await conn.execute(POSTGRES_LAG_QUERY)).scalar_one())
+
+    async def check(self) -> None:
+        """Measures every replica's lag and updates which ones receive reads."""
+        async def check_one(replica: Replica) -> None:
+            try:
+                replica.lag = await asyncio.wait_for(self._measure_lag(replica), DB_REPLICA_CHECK_TIMEOUT)
+            except Exception as e:
+                if replica.available:
+                    print(f"Read replica {replica.name} is unreachable, reading from the others: {e!r}")
+                replica.lag, replica.available = None, False
+            else:
+                available = replica.lag <= DB_REPLICA_MAX_LAG_SECONDS
+                if available != replica.available:
+                    print(f"Read replica {replica.name} is {'back' if available else 'lagging'} ({replica.lag:.1f}s behind).")
+                replica.available = available
+                DB_REPLICA_LAG_SECONDS.labels(engine=replica.name).set(replica.lag)
+            DB_REPLICA_AVAILABLE.labels(engine=replica.name).set(1 if replica.available else 0)
+
+        await asyncio.gather(*(check_one(replica) for replica in self.replicas))
+
+    async def monitor(self, interval: float = DB_REPLICA_CHECK_INTERVAL) -> None:
+        """Background task that keeps the replicas' availability up to date."""
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
@@ -1,11 +1,18 @@
 # app/routers/orders.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from datetime import date, datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
 
-from app import crud, schemas, models
-from app.database import get_db
+from app import bulk, crud, idempotency, schemas, worker
+from app.database import get_db, get_read_db
+from app.pagination import next_cursor_headers
+from app.queries import aggregates as aggregate_queries
+from app.queries import orders as order_queries
+from app.serialization import json_response, rows_response
 from app.auth import get_current_active_user, get_current_admin_user
 
 router = APIRouter(
@@ -16,68 +23,265 @@ router = APIRouter(
 
 
 @router.post(
-    "/", response_model=schemas.OrderResponse, status_code=status.HTTP_201_CREATED
+    "/",
+    response_model=schemas.OrderResponse,
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        202: {
+            "model": schemas.OrderProcessingResponse,
+            "description": "Accepted for processing (ORDER_INTAKE_MODE=queued)",
+        }
+    },
 )
-def create_order_endpoint(
+async def create_order_endpoint(
     order: schemas.OrderCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
 ):
     """
     Create a new order for the current authenticated user.
-    Deducts product quantities from inventory.
+    Deducts product quantities from inventory, or takes them from the reservation
+    given as `reservation_id`.
+    With an `Idempotency-Key` header, retries of the request return the first
+    response (marked `Idempotent-Replayed: true`) instead of creating another order.
+    The order is `confirmed` once its stock is deducted. In queued intake mode it is
+    recorded as `pending` and processed by the order workers: the response is 202
+    with the processing status, whose `status_url` (also in the `Location` header)
+    can be polled until the order is `confirmed` or `cancelled`.
+    """
+    if idempotency_key is not None:
+        try:
+            stored = await idempotency.claim(
+                db, current_user.id, idempotency_key, idempotency.request_hash(order)
+            )
+        except idempotency.IdempotencyKeyReused:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used for a different request",
+            )
+        if stored is not None:
+            headers = {"Idempotent-Replayed": "true"}
+            if stored.status_code == status.HTTP_202_ACCEPTED:
+                # As on the original queued response
+                headers["Location"] = orjson.loads(stored.body)["status_url"]
+            return Response(
+                content=stored.body,
+                status_code=stored.status_code,
+                media_type="application/json",
+                headers=headers,
+            )
+    if worker.ORDER_INTAKE_MODE == "queued":
+        try:
+            processing = await crud.enqueue_user_order(
+                db=db,
+                order=order,
+                buyer_id=current_user.id,
+                idempotency_key=idempotency_key,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return json_response(
+            schemas.OrderProcessingResponse,
+            processing,
+            status_code=status.HTTP_202_ACCEPTED,
+            headers={"Location": processing["status_url"]},
+        )
+    try:
+        # The returned order already carries its items and server-generated columns
+        db_order = await crud.create_user_order(
+            db=db,
+            order=order,
+            buyer_id=current_user.id,
+            idempotency_key=idempotency_key,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return json_response(
+        schemas.OrderResponse, db_order, status_code=status.HTTP_201_CREATED
+    )
+
+
+@router.post(
+    "/reservations",
+    response_model=schemas.ReservationResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_reservation_endpoint(
+    reservation: schemas.ReservationCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
+    """
+    Hold stock for the current user until `expires_at`, e.g. while they check out.
+    Pass the reservation's `id` as `reservation_id` when creating the order to use
+    the held stock; reservations that are not ordered in time are released.
     """
     try:
-        db_order = crud.create_user_order(db=db, order=order, buyer_id=current_user.id)
-        # Eager load items for the response
-        db_order_with_items = (
-            db.query(models.Order)
-            .options(joinedload(models.Order.items))
-            .filter(models.Order.id == db_order.id)
-            .first()
+        db_reservation = await crud.create_reservation(
+            db=db, reservation=reservation, buyer_id=current_user.id
         )
-        return db_order_with_items
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return json_response(
+        schemas.ReservationResponse,
+        db_reservation,
+        status_code=status.HTTP_201_CREATED,
+    )
+
+
+@router.delete(
+    "/reservations/{reservation_id}", status_code=status.HTTP_204_NO_CONTENT
+)
+async def release_reservation_endpoint(
+    reservation_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
+    """
+    Release one of the current user's reservations, returning its stock.
+    """
+    if not await crud.release_reservation(
+        db, reservation_id=reservation_id, buyer_id=current_user.id
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Reservation not found"
+        )
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+def _next_cursor_headers(orders: list, limit: int) -> dict:
+    """Exposes the cursor of the next page in the `X-Next-Cursor` header."""
+    return next_cursor_headers(
+        orders, limit, key=lambda order: (order.created_at, order.id)
+    )
 
 
 @router.get("/me", response_model=List[schemas.OrderResponse])
-def read_my_orders(
+async def read_my_orders(
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
+    """
+    Retrieve a list of orders made by the current authenticated user, newest first.
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next page.
+    """
+    orders = await order_queries.list_order_rows(
+        db, buyer_id=current_user.id, skip=skip, limit=limit, cursor=cursor
+    )
+    return rows_response(orders, headers=_next_cursor_headers(orders, limit))
+
+
+@router.get("/me/summary", response_model=List[schemas.OrderSummaryResponse])
+async def read_my_order_summaries(
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
+    """
+    Retrieve the current user's orders without their items, newest first.
+    """
+    orders = await order_queries.list_order_rows(
+        db,
+        buyer_id=current_user.id,
+        skip=skip,
+        limit=limit,
+        cursor=cursor,
+        include_items=False,
+    )
+    return rows_response(orders, headers=_next_cursor_headers(orders, limit))
+
+
+@router.get("/summary", response_model=List[schemas.OrderSummaryResponse])
+async def read_all_order_summaries(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: schemas.UserResponse = Depends(
+        get_current_admin_user
+    ),  # Only admins can view all orders
+):
+    """
+    Retrieve all orders without their items, newest first. Requires admin privileges.
+    """
+    orders = await order_queries.list_order_rows(
+        db, skip=skip, limit=limit, cursor=cursor, include_items=False
+    )
+    return rows_response(orders, headers=_next_cursor_headers(orders, limit))
+
+
+@router.get("/revenue/daily", response_model=List[schemas.DailyRevenueResponse])
+async def read_daily_revenue(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
+):
+    """
+    Retrieve revenue, cost and margin per day (UTC) from `start` to `end` inclusive,
+    for days with orders. Defaults to the last 30 days. Requires admin privileges.
+    Served from the `daily_revenue` aggregate, without scanning orders.
+    """
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must not be after end",
+        )
+    days = await aggregate_queries.list_daily_revenue(db, start=start, end=end)
+    return rows_response(days)
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {bulk.CSV_MEDIA_TYPE: {}, bulk.NDJSON_MEDIA_TYPE: {}}}
+    },
+)
+async def export_orders_endpoint(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    # Not named `status`, which would shadow `fastapi.status` in this handler
+    order_status: Optional[schemas.OrderStatus] = Query(None, alias="status"),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
 ):
     """
-    Retrieve a list of orders made by the current authenticated user.
+    Export orders, oldest first, as NDJSON (one order with its items per line) or CSV
+    (one line per order item). Requires admin privileges.
+    - `status`: only orders with this status (one of `schemas.OrderStatus`).
+    - `created_from` / `created_to`: only orders created in that half-open range.
+    Rows are streamed from a database cursor at the pace the client reads them, so
+    memory use does not grow with the number of orders exported.
     """
-    orders = (
-        db.query(models.Order)
-        .options(joinedload(models.Order.items))
-        .filter(models.Order.buyer_id == current_user.id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+    media_type = bulk.CSV_MEDIA_TYPE if format == "csv" else bulk.NDJSON_MEDIA_TYPE
+    stmt = bulk.order_export_statement(order_status, created_from, created_to)
+    return StreamingResponse(
+        bulk.export_orders(media_type, stmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'},
     )
-    return orders
 
 
 @router.get("/{order_id}", response_model=schemas.OrderResponse)
-def read_order_by_id(
+async def read_order_by_id(
     order_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
 ):
     """
     Retrieve a specific order by ID.
     Only accessible by the buyer of the order or an admin.
     """
-    db_order = (
-        db.query(models.Order)
-        .options(joinedload(models.Order.items))
-        .filter(models.Order.id == order_id)
-        .first()
-    )
+    db_order = await order_queries.get_order_row(db, order_id)
     if db_order is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
@@ -88,26 +292,50 @@ def read_order_by_id(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to view this order",
         )
-    return db_order
+    return rows_response(db_order)
+
+
+@router.get("/{order_id}/status", response_model=schemas.OrderProcessingResponse)
+async def read_order_processing(
+    order_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
+    """
+    Retrieve the processing status of an order (see `POST /orders/` in queued mode).
+    Only accessible by the buyer of the order or an admin.
+    Read from the primary, since the workers update it as they go.
+    """
+    processing = await crud.get_order_processing(db, order_id)
+    if processing is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
+        )
+    buyer_id, order_processing = processing
+    if buyer_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this order",
+        )
+    return json_response(schemas.OrderProcessingResponse, order_processing)
 
 
 @router.get("/", response_model=List[schemas.OrderResponse])
-def read_all_orders(
+async def read_all_orders(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: schemas.UserResponse = Depends(
         get_current_admin_user
     ),  # Only admins can view all orders
 ):
     """
-    Retrieve a list of all orders in the system. Requires admin privileges.
+    Retrieve a list of all orders in the system, newest first. Requires admin privileges.
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next page.
+    Served from a read replica when one is configured (it may lag slightly behind).
     """
-    orders = (
-        db.query(models.Order)
-        .options(joinedload(models.Order.items))
-        .offset(skip)
-        .limit(limit)
-        .all()
+    orders = await order_queries.list_order_rows(
+        db, skip=skip, limit=limit, cursor=cursor
     )
-    return orders
+    return rows_response(orders, headers=_next_cursor_headers(orders, limit))
@@ -1,132 +1,302 @@
-# app/routers/users.py
-
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
-
-from app import crud, schemas, models
-from app.database import get_db
-from app.auth import (
-    create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES,
-    get_current_active_user, get_current_admin_user, verify_password
-)
-from datetime import timedelta
+# app/routers/products.py
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+
+from app import bulk, catalog, crud, inventory, schemas
+from app.database import get_db, get_read_db
+from app.metrics.db_queries import exempt_current_request
+from app.pagination import next_cursor_headers
+from app.queries import aggregates as aggregate_queries
+from app.queries import products as product_queries
+from app.serialization import json_response, rows_response
+from app.auth import get_current_admin_user
 
 router = APIRouter(
-    prefix="/users",
-    tags=["Users & Authentication"],
+    prefix="/products",
+    tags=["Products"],
     responses={404: {"description": "Not found"}},
 )
 
-@router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def create_user_account(user: schemas.UserCreate, db: Session = Depends(get_db)):
+
+@router.get("/", response_model=List[schemas.ProductResponse])
+async def read_products(
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Retrieve the product catalog, ordered by ID.
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next page.
+    """
+    products = await product_queries.list_products(
+        db, skip=skip, limit=limit, cursor=cursor
+    )
+    headers = next_cursor_headers(products, limit, key=lambda product: (product.id,))
+    return rows_response(products, headers=headers)
+
+
+@router.post(
+    "/import",
+    response_model=schemas.ProductImportResult,
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                bulk.CSV_MEDIA_TYPE: {"schema": {"type": "string"}},
+                bulk.NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}},
+            }
+        }
+    },
+)
+async def import_products_endpoint(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
+):
     """
-    Register a new user account.
+    Bulk-import products from the request body. Requires admin privileges.
+    Send CSV with a header row (`Content-Type: text/csv`) or one JSON object per line
+    (`Content-Type: application/x-ndjson`) with the `ProductCreate` fields. Rows whose
+    `sku` already exists update that product. The body is processed as it is received;
+    invalid rows are skipped and listed in the result with their line numbers.
     """
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in (bulk.CSV_MEDIA_TYPE, bulk.NDJSON_MEDIA_TYPE):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Send {bulk.CSV_MEDIA_TYPE} or {bulk.NDJSON_MEDIA_TYPE}",
+        )
+    # One upsert per batch of rows is expected here, not an N+1 loop
+    exempt_current_request()
+    try:
+        result = await bulk.import_products(db, request.stream(), media_type)
+    except UnicodeDecodeError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
+            detail="The file is not valid UTF-8 (rows before the error were imported)",
         )
-    return crud.create_user(db=db, user=user)
+    return json_response(schemas.ProductImportResult, result)
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {bulk.CSV_MEDIA_TYPE: {}, bulk.NDJSON_MEDIA_TYPE: {}}}
+    },
+)
+async def export_products_endpoint(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
+):
+    """
+    Export the whole catalog as NDJSON or CSV, ordered by ID. Requires admin privileges.
+    Rows are streamed from a database cursor, so the response starts immediately and
+    memory use does not grow with the catalog.
+    """
+    media_type = bulk.CSV_MEDIA_TYPE if format == "csv" else bulk.NDJSON_MEDIA_TYPE
+    return StreamingResponse(
+        bulk.export_products(media_type),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+
+@router.get("/search", response_model=List[schemas.ProductSearchResult])
+async def search_products_endpoint(
+    q: str = Query(..., min_length=1, max_length=200),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Search products by name and description, best match first.
+    - `q`: words to look for; tolerates typos and unfinished words in product names,
+      and supports `"exact phrase"`, `or` and `-excluded` terms.
+    - `min_price` / `max_price`: price range, inclusive.
+    - `in_stock`: only products with quantity left.
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next page.
+    """
+    products = await product_queries.search_products(
+        db,
+        q,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock=in_stock,
+        limit=limit,
+        cursor=cursor,
+    )
+    headers = next_cursor_headers(
+        products, limit, key=lambda product: (product.rank, product.id)
+    )
+    return rows_response(products, headers=headers)
 
-@router.post("/token", response_model=schemas.Token)
-def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+
+@router.get(
+    "/{product_id}",
+    response_model=schemas.ProductResponse,
+    responses={304: {"description": "Not modified"}},
+)
+async def read_product(
+    product_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
 ):
     """
-    Login to get an access token.
-    Requires `username` (email) and `password`.
+    Retrieve a single product.
+    Served from the in-process product cache when possible. Responses carry an `ETag`;
+    sending it back in `If-None-Match` returns 304 without a body.
     """
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    entry = await catalog.get_cached_product(db, product_id)
+    if entry is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_404_NOT_FOUND, detail="Product not found"
         )
-    if not user.is_active:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={catalog.PRODUCT_CACHE_MAX_AGE}",
+    }
+    if catalog.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
 
-@router.get("/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models.User = Depends(get_current_active_user)):
+@router.get("/{product_id}/sales", response_model=schemas.ProductSalesResponse)
+async def read_product_sales(
+    product_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
+):
     """
-    Get information about the current authenticated user.
+    Retrieve a product's units sold, revenue, cost and margin.
+    Requires admin privileges.
+    Served from the `product_sales_stats` aggregate, without scanning order items.
     """
-    return current_user
+    sales = await aggregate_queries.get_product_sales(db, product_id=product_id)
+    return rows_response(sales)
 
-@router.get("/", response_model=List[schemas.UserResponse])
-def read_users(
-    skip: int = 0, limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user) # Only admins can list all users
+
+@router.get("/{product_id}/inventory", response_model=schemas.InventoryResponse)
+async def read_product_inventory(
+    product_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
 ):
     """
-    Retrieve a list of all users. Requires admin privileges.
+    Retrieve a product's stock and its inventory shards. Requires admin privileges.
+    Read from the primary, since checkouts update the shards continuously.
     """
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+    product_inventory = await inventory.get_inventory(db, product_id=product_id)
+    if product_inventory is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Product not found"
+        )
+    return json_response(schemas.InventoryResponse, product_inventory)
 
-@router.get("/{user_id}", response_model=schemas.UserResponse)
-def read_user(
-    user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+
+@router.put(
+    "/{product_id}/inventory/shards", response_model=schemas.InventoryResponse
+)
+async def update_product_inventory_shards(
+    product_id: int,
+    shards_update: schemas.InventoryShardsUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
 ):
     """
-    Retrieve a specific user by ID.
-    Only allows access to own profile or if current user is an admin.
+    Split a product's stock over `shards` inventory shards, or merge it back with 0.
+    Requires admin privileges.
+    Checkouts of a sharded product decrement one shard instead of locking the
+    product row, so that many of them can run at once (for flash-sale products).
     """
-    if current_user.id != user_id and not current_user.is_admin:
+    try:
+        await inventory.configure_shards(db, product_id, shards_update.shards)
+    except LookupError:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to view this user's profile"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Product not found"
         )
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return db_user
-
-@router.put("/{user_id}", response_model=schemas.UserResponse)
-def update_user_data(
-    user_id: int,
-    user_update: schemas.UserUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    product_inventory = await inventory.get_inventory(db, product_id=product_id)
+    return json_response(schemas.InventoryResponse, product_inventory)
+
+
+@router.post(
+    "/", response_model=schemas.ProductResponse, status_code=status.HTTP_201_CREATED
+)
+async def create_product_endpoint(
+    product: schemas.ProductCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(
+        get_current_admin_user
+    ),  # Only admins can manage the catalog
 ):
     """
-    Update a user's information.
-    Only allows users to update their own profile or if current user is an admin.
+    Add a product to the catalog. Requires admin privileges.
     """
-    if current_user.id != user_id and not current_user.is_admin:
+    try:
+        db_product = await crud.create_product(db=db, product=product)
+    except IntegrityError:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to update this user's profile"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A product with this SKU already exists",
         )
-    db_user = crud.update_user(db, user_id=user_id, user_update=user_update)
-    if db_user is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return db_user
-
-@router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user_data(
-    user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_admin_user) # Only admins can delete users
+    return json_response(
+        schemas.ProductResponse, db_product, status_code=status.HTTP_201_CREATED
+    )
+
+
+@router.put("/{product_id}", response_model=schemas.ProductResponse)
+async def update_product_endpoint(
+    product_id: int,
+    product_update: schemas.ProductUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
 ):
     """
-    Delete a user. Requires admin privileges.
+    Update a product. Requires admin privileges.
     """
-    db_user = crud.delete_user(db, user_id=user_id)
-    if db_user is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return {"message": "User deleted successfully"}
+    try:
+        db_product = await crud.update_product(
+            db, product_id=product_id, product_update=product_update
+        )
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A product with this SKU already exists",
+        )
+    if db_product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Product not found"
+        )
+    return json_response(schemas.ProductResponse, db_product)
+
 
+@router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_product_endpoint(
+    product_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_admin_user),
+):
+    """
+    Delete a product. Requires admin privileges.
+    Products that appear in existing orders cannot be deleted.
+    """
+    try:
+        db_product = await crud.delete_product(db, product_id=product_id)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Product is referenced by existing orders",
+        )
+    if db_product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Product not found"
+        )
@@ -2,17 +2,21 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
 from app import crud, schemas, models
-from app.database import get_db
+from app.database import get_db, get_read_db
+from app.pagination import next_cursor_headers
+from app.queries import aggregates as aggregate_queries
+from app.queries import users as user_queries
+from app.serialization import json_response, rows_response
 from app.auth import (
-    create_access_token,
+    create_user_access_token,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     get_current_active_user,
     get_current_admin_user,
-    verify_password,
+    authenticate_user,
 )
 from datetime import timedelta
 
@@ -28,28 +32,36 @@ router = APIRouter(
     response_model=schemas.UserResponse,
     status_code=status.HTTP_201_CREATED,
 )
-def create_user_account(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user_account(
+    user: schemas.UserCreate, db: AsyncSession = Depends(get_db)
+):
     """
     Register a new user account.
     """
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered"
         )
-    return crud.create_user(db=db, user=user)
+    db_user = await crud.create_user(db=db, user=user)
+    return json_response(
+        schemas.UserResponse, db_user, status_code=status.HTTP_201_CREATED
+    )
 
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+async def login_for_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Login to get an access token.
     Requires `username` (email) and `password`.
     """
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await authenticate_user(
+        db, email=form_data.username, password=form_data.password
+    )
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -61,41 +73,46 @@ def login_for_access_token(
         )
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.get("/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models.User = Depends(get_current_active_user)):
+async def read_users_me(
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
     """
     Get information about the current authenticated user.
     """
-    return current_user
+    return json_response(schemas.UserResponse, current_user)
 
 
 @router.get("/", response_model=List[schemas.UserResponse])
-def read_users(
+async def read_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: schemas.UserResponse = Depends(
         get_current_admin_user
     ),  # Only admins can list all users
 ):
     """
     Retrieve a list of all users. Requires admin privileges.
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next page;
+    `skip` is still honoured when no cursor is given.
+    Served from a read replica when one is configured (it may lag slightly behind).
     """
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+    users = await user_queries.list_users(db, skip=skip, limit=limit, cursor=cursor)
+    headers = next_cursor_headers(users, limit, key=lambda user: (user.id,))
+    return rows_response(users, headers=headers)
 
 
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-def read_user(
+async def read_user(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
 ):
     """
     Retrieve a specific user by ID.
@@ -106,20 +123,40 @@ def read_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to view this user's profile",
         )
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = await user_queries.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
-    return db_user
+    return rows_response(db_user)
+
+
+@router.get("/{user_id}/stats", response_model=schemas.UserOrderStatsResponse)
+async def read_user_order_stats(
+    user_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
+):
+    """
+    Retrieve a user's order count and lifetime spend.
+    Only allows access to own totals or if current user is an admin.
+    Served from the `user_order_stats` aggregate, without scanning the user's orders.
+    """
+    if current_user.id != user_id and not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this user's order totals",
+        )
+    stats = await aggregate_queries.get_user_order_stats(db, user_id=user_id)
+    return rows_response(stats)
 
 
 @router.put("/{user_id}", response_model=schemas.UserResponse)
-def update_user_data(
+async def update_user_data(
     user_id: int,
     user_update: schemas.UserUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(get_current_active_user),
 ):
     """
     Update a user's information.
@@ -130,26 +167,26 @@ def update_user_data(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to update this user's profile",
         )
-    db_user = crud.update_user(db, user_id=user_id, user_update=user_update)
+    db_user = await crud.update_user(db, user_id=user_id, user_update=user_update)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
-    return db_user
+    return json_response(schemas.UserResponse, db_user)
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user_data(
+async def delete_user_data(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserResponse = Depends(
         get_current_admin_user
     ),  # Only admins can delete users
 ):
     """
     Delete a user. Requires admin privileges.
     """
-    db_user = crud.delete_user(db, user_id=user_id)
+    db_user = await crud.delete_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
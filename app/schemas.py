@@ -1,8 +1,8 @@
 # app/schemas.py
 
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Literal, Optional
+from datetime import date, datetime
 
 # --- User Schemas ---
 
@@ -55,7 +55,7 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     """Schema for data contained within a JWT token."""
     email: Optional[str] = None
-    # You might add user ID or roles here if needed for authorization checks
+    user_id: Optional[int] = None
 
 # --- Product Schemas ---
 
@@ -67,6 +67,7 @@ class ProductBase(BaseModel):
     quantity: int = Field(..., ge=0) # Inventory quantity
     buying_price: float = Field(..., gt=0) # Cost to acquire
     selling_price: float = Field(..., gt=0) # Price for sale
+    sku: Optional[str] = Field(None, min_length=1, max_length=64) # Unique when set; bulk imports upsert on it
 
 class ProductCreate(ProductBase):
     """Schema for creating a new product."""
@@ -91,8 +92,27 @@ class ProductResponse(ProductBase):
     class Config:
         from_attributes = True # Changed from orm_mode = True for Pydantic v2
 
+class ProductSearchResult(ProductResponse):
+    """A product matching a search, with its relevance (higher is better)."""
+    rank: float
+
+class ProductImportError(BaseModel):
+    """A row of a bulk import that was not loaded."""
+    line: int # Line number in the uploaded file (the CSV header is line 1)
+    errors: List[str]
+
+class ProductImportResult(BaseModel):
+    """Outcome of a bulk product import."""
+    processed: int # Data rows read from the file
+    imported: int # Rows inserted or updated
+    failed: int # Rows rejected by validation or by the database
+    errors: List[ProductImportError] = [] # Per-row errors (capped, see `failed` for the total)
+
 # --- Order Schemas ---
 
+# The states of `Order.status`
+OrderStatus = Literal["pending", "confirmed", "shipped", "completed", "cancelled"]
+
 class OrderItemBase(BaseModel):
     """Base schema for an item within an order."""
     product_id: int
@@ -119,17 +139,102 @@ class OrderBase(BaseModel):
 class OrderCreate(OrderBase):
     """Schema for creating a new order (includes items)."""
     items: List[OrderItemCreate]
+    reservation_id: Optional[int] = None # Reservation whose stock the order uses first
 
-class OrderResponse(OrderBase):
-    """Schema for order data returned in API responses."""
+class OrderSummaryResponse(OrderBase):
+    """Schema for order data returned in API responses, without the order items."""
     id: int
     buyer_id: int
     total_amount: float
     status: str
     created_at: datetime
     updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True # Changed from orm_mode = True for Pydantic v2
+
+class OrderResponse(OrderSummaryResponse):
+    """Schema for order data returned in API responses."""
     items: List[OrderItemResponse] = [] # List of items in the order
 
+class OrderProcessingResponse(BaseModel):
+    """
+    Processing status of an order accepted for asynchronous processing.
+    `state` is queued (waiting, or retrying after `attempts` failures), done, or dead
+    (failed for good: `last_error` says why and the order is cancelled).
+    """
+    order_id: int
+    status: str # The order's status
+    state: str
+    attempts: int = 0
+    last_error: Optional[str] = None
+    status_url: str # Where to poll this status
+
+class ReservationCreate(BaseModel):
+    """Schema for reserving stock ahead of an order."""
+    items: List[OrderItemCreate]
+
+class ReservationItemResponse(OrderItemBase):
+    """Quantity of a product held by a reservation."""
+
     class Config:
         from_attributes = True # Changed from orm_mode = True for Pydantic v2
 
+class ReservationResponse(BaseModel):
+    """A stock reservation; it is released automatically at `expires_at` unless ordered."""
+    id: int
+    expires_at: datetime
+    items: List[ReservationItemResponse] = []
+
+    class Config:
+        from_attributes = True # Changed from orm_mode = True for Pydantic v2
+
+
+# --- Inventory Schemas ---
+
+class InventoryShardsUpdate(BaseModel):
+    """Schema for changing the number of inventory shards of a product (0 for none)."""
+    shards: int = Field(..., ge=0)
+
+class InventoryShardResponse(BaseModel):
+    """Stock held by one inventory shard."""
+    shard: int
+    quantity: int
+
+    class Config:
+        from_attributes = True # Changed from orm_mode = True for Pydantic v2
+
+class InventoryResponse(BaseModel):
+    """A product's stock and how it is split over inventory shards."""
+    product_id: int
+    quantity: int # Total stock (the sum of the shards for sharded products)
+    stock_shards: int
+    shards: List[InventoryShardResponse] = []
+
+
+# --- Sales Aggregate Schemas ---
+
+class UserOrderStatsResponse(BaseModel):
+    """A user's order totals; zero for users who have not ordered yet."""
+    user_id: int
+    order_count: int = 0
+    total_spent: float = 0.0
+    first_order_at: Optional[datetime] = None
+    last_order_at: Optional[datetime] = None
+
+class SalesTotals(BaseModel):
+    """Base schema for sales totals; margin is revenue minus cost (at the buying price)."""
+    units_sold: int = 0
+    order_count: int = 0 # Orders included in the totals
+    revenue: float = 0.0
+    cost: float = 0.0
+    margin: float = 0.0
+
+class ProductSalesResponse(SalesTotals):
+    """A product's sales totals; zero for products that have not sold yet."""
+    product_id: int
+    last_sold_at: Optional[datetime] = None
+
+class DailyRevenueResponse(SalesTotals):
+    """Sales totals of one day (UTC)."""
+    day: date
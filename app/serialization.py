@@ -0,0 +1,79 @@
+# app/serialization.py
+
+from functools import lru_cache
+from typing import Any, Mapping, Optional
+
+import orjson
+from fastapi import Response, status
+from pydantic import TypeAdapter
+from sqlalchemy.engine import Row
+
+
+@lru_cache(maxsize=None)
+def type_adapter(response_type: Any) -> TypeAdapter:
+    """Returns the TypeAdapter for a response type, built (and its schema compiled) once."""
+    return TypeAdapter(response_type)
+
+
+def dump_json(response_type: Any, data: Any) -> bytes:
+    """
+    Serializes ORM objects, rows or models as `response_type` straight to JSON bytes.
+
+    Returning ORM objects from an endpoint makes FastAPI validate them against the
+    `response_model`, dump the result to Python dicts and lists, and then JSON-encode
+    those. Here pydantic-core reads the attributes once (`from_attributes`) and writes
+    the bytes directly, without the intermediate Python objects.
+    """
+    adapter = type_adapter(response_type)
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+
+def json_response(
+    response_type: Any,
+    data: Any,
+    status_code: int = status.HTTP_200_OK,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """
+    Builds a pre-encoded JSON response. FastAPI passes `Response` objects through
+    untouched, so the route's `response_model` is only used for the OpenAPI schema.
+    """
+    return Response(
+        content=dump_json(response_type, data),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
+
+
+def _encode_row(value: Any) -> Any:
+    """orjson fallback for SQLAlchemy rows, which are encoded as objects keyed by column."""
+    if isinstance(value, Row):
+        return value._asdict()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_rows_json(data: Any) -> bytes:
+    """
+    Serializes rows from the column-projected read queries (`app.queries`) with orjson.
+
+    These rows hold exactly the columns of their response schema (see `columns_for`)
+    and come straight from our own database, so they are not validated again; that
+    skips, among others, the email validation of every listed user. Datetimes and
+    floats are written exactly as pydantic writes them ("Z" for UTC).
+    """
+    return orjson.dumps(data, default=_encode_row, option=orjson.OPT_UTC_Z)
+
+
+def rows_response(
+    data: Any,
+    status_code: int = status.HTTP_200_OK,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """Builds a pre-encoded JSON response from column-projected rows."""
+    return Response(
+        content=dump_rows_json(data),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
@@ -0,0 +1,237 @@
+# app/server.py
+
+"""
+Production entry point: `python -m app.server`.
+
+Runs the application under gunicorn with uvicorn workers:
+- one worker per CPU core available to the container (cgroup quota aware);
+- uvloop and httptools in every worker;
+- graceful restarts (`kill -HUP <master pid>`) and max-requests recycling with jitter;
+- optional preloading, so workers share the imported application copy-on-write.
+
+Before forking it checks that the database pools of all workers fit within the
+server's `max_connections`. Use `uvicorn app.main:app --reload` for development.
+"""
+
+import asyncio
+import glob
+import math
+import os
+import tempfile
+from typing import Optional
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from .config import DatabaseSettings, env_bool, env_float, env_int
+
+# Address gunicorn listens on
+BIND = os.getenv("BIND", "0.0.0.0:8000")
+
+# Worker processes; defaults to the CPU cores available to the container
+WEB_CONCURRENCY = env_int("WEB_CONCURRENCY", 0)
+
+# Recycle a worker after this many requests (plus up to the jitter, so workers do
+# not all restart at once) to bound the effect of slow memory growth. 0 disables.
+MAX_REQUESTS = env_int("MAX_REQUESTS", 10000)
+MAX_REQUESTS_JITTER = env_int("MAX_REQUESTS_JITTER", 1000)
+
+# Seconds a worker gets to finish in-flight requests on restart or shutdown
+GRACEFUL_TIMEOUT = env_int("GRACEFUL_TIMEOUT", 30)
+
+# Seconds without a heartbeat before the master kills a stuck worker
+WORKER_TIMEOUT = env_int("WORKER_TIMEOUT", 60)
+
+# Seconds an idle keep-alive connection is held open
+KEEPALIVE = env_int("KEEPALIVE", 5)
+
+# Log every request (request metrics are already exported to Prometheus)
+ACCESS_LOG = env_bool("ACCESS_LOG", False)
+
+# Import the application in the master before forking (faster restarts, shared memory)
+PRELOAD_APP = env_bool("PRELOAD_APP", True)
+
+# Refuse to start when the pools could exceed max_connections (otherwise just warn)
+DB_CONNECTION_CHECK_STRICT = env_bool("DB_CONNECTION_CHECK_STRICT", True)
+
+# Seconds to wait for the database during the startup self-check
+DB_CONNECTION_CHECK_TIMEOUT = env_float("DB_CONNECTION_CHECK_TIMEOUT", 5.0)
+
+
+def available_cpus() -> float:
+    """
+    Returns the number of CPUs this process may use: the cgroup CPU quota when one is
+    set (v2 `cpu.max` or v1 `cpu.cfs_quota_us`), otherwise the scheduler affinity.
+    `os.cpu_count()` reports the host's cores and would oversubscribe a limited container.
+    """
+    cpus = float(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+    quota = _cgroup_cpu_quota()
+    return min(cpus, quota) if quota else cpus
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """Reads the container's CPU quota in cores, or None when it is unlimited."""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: quota is -1 when unlimited
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def default_workers() -> int:
+    """
+    One async worker per available core. A fractional quota is rounded down so the
+    workers are not throttled by the CFS scheduler.
+    """
+    return max(1, math.floor(available_cpus()))
+
+
+async def _server_connection_limit(settings: DatabaseSettings) -> int:
+    """Returns the connections the database allows to non-superusers."""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    engine = create_async_engine(settings.url, poolclass=NullPool, connect_args=settings.connect_args())
+    try:
+        async with engine.connect() as conn:
+            max_connections = int((await conn.execute(text("SHOW max_connections"))).scalar_one())
+            reserved = int((await conn.execute(text("SHOW superuser_reserved_connections"))).scalar_one())
+        return max_connections - reserved
+    finally:
+        await engine.dispose()
+
+
+def check_connection_budget(workers: int, settings: Optional[DatabaseSettings] = None) -> None:
+    """
+    Verifies that (pool_size + max_overflow) * workers stays under max_connections on
+    the primary and on every read replica (each worker has a pool per server).
+    Raises SystemExit when it does not and the check is strict.
+    Skipped when there is no pool to size (NullPool) or PgBouncer sits in between,
+    since then the limit to respect is PgBouncer's pool, not the client pools.
+    """
+    settings = settings or DatabaseSettings.from_env()
+    if settings.disable_pool or settings.pgbouncer:
+        print("Skipping connection budget check (pooling is delegated to PgBouncer).")
+        return
+    servers = [("primary", settings)] + [
+        (f"replica{index}", settings.for_replica(url)) for index, url in enumerate(settings.replica_urls)
+    ]
+    required = settings.max_connections * workers
+    for name, server_settings in servers:
+        try:
+            limit = asyncio.run(asyncio.wait_for(_server_connection_limit(server_settings), DB_CONNECTION_CHECK_TIMEOUT))
+        except Exception as e:
+            print(f"Skipping connection budget check on {name}, could not query the database: {e!r}")
+            continue
+        message = (
+            f"{workers} workers x (DB_POOL_SIZE={settings.pool_size} + DB_MAX_OVERFLOW={settings.max_overflow})"
+            f" = {required} connections, {name} allows {limit}"
+        )
+        if required < limit:
+            print(f"Connection budget OK: {message}.")
+        elif DB_CONNECTION_CHECK_STRICT:
+            raise SystemExit(f"Connection budget exceeded: {message}. Lower the pool settings or WEB_CONCURRENCY.")
+        else:
+            print(f"WARNING: connection budget exceeded: {message}.")
+
+
+def prepare_metrics_dir(workers: int) -> None:
+    """
+    Prepares the shared directory for multiprocess Prometheus metrics. With several
+    workers a temporary directory is used unless PROMETHEUS_MULTIPROC_DIR is set; files
+    left over from a previous run are removed. Must run before prometheus_client is imported.
+    """
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        if workers == 1:
+            return
+        directory = tempfile.mkdtemp(prefix="prometheus_multiproc_")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(path)
+
+
+class AppUvicornWorker(UvicornWorker):
+    """Uvicorn worker pinned to uvloop and httptools (fails fast if they are missing)."""
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+
+def post_fork(server, worker) -> None:
+    """
+    Runs in each worker right after the fork. A preloaded application may have opened
+    pooled connections in the master; they must not be shared across processes, so the
+    worker drops its copies (without closing them, which would affect the master's).
+    """
+    from .database import engine, replica_engines
+
+    for worker_engine in (engine, *replica_engines):
+        worker_engine.sync_engine.dispose(close=False)
+
+
+def child_exit(server, worker) -> None:
+    """Runs in the master when a worker exits, including workers that were killed."""
+    from .metrics.prometheus_exporter import mark_process_dead
+
+    mark_process_dead(worker.pid)
+
+
+class GunicornApplication(BaseApplication):
+    """Embeds gunicorn so the configuration lives in code rather than a config file."""
+    def __init__(self, app_uri: str, options: dict):
+        self.app_uri = app_uri
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from gunicorn.util import import_app
+
+        return import_app(self.app_uri)
+
+
+def main() -> None:
+    workers = WEB_CONCURRENCY or default_workers()
+    print(f"Starting {workers} worker(s) on {BIND} ({available_cpus():g} CPUs available).")
+    prepare_metrics_dir(workers)
+    # Share the cores between the workers' bcrypt pools instead of one pool per core each
+    os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(1, default_workers() // workers)))
+    check_connection_budget(workers)
+
+    options = {
+        "bind": BIND,
+        "workers": workers,
+        "worker_class": "app.server.AppUvicornWorker",
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "preload_app": PRELOAD_APP,
+        # Heartbeat files on tmpfs; a container's overlay filesystem can stall them
+        "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None,
+        "accesslog": "-" if ACCESS_LOG else None,
+        "errorlog": "-",
+        "post_fork": post_fork,
+        "child_exit": child_exit,
+    }
+    GunicornApplication("app.main:app", options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+# app/worker.py
+
+"""
+Asynchronous order processing: the worker side of ORDER_INTAKE_MODE=queued.
+
+In queued mode `POST /orders/` only records the order as `pending` with a queued
+`OrderJob` and answers 202 with a status URL (see `crud.enqueue_user_order`). Worker
+processes, started with `python -m app.worker` and scaled independently of the API,
+do the rest of the checkout:
+- claim due jobs in batches with `FOR UPDATE SKIP LOCKED`, so any number of workers
+  share the queue without claiming the same job twice;
+- lock the batch's reservations, then its products, up front in id order (the order
+  a single checkout locks them in), then process each job in its own
+  savepoint: deduct the stock (`crud.deduct_order_stock`), update the sales
+  aggregates and confirm the order. The batch commits once;
+- retry jobs that failed on a transient error with exponential backoff, up to
+  ORDER_JOB_MAX_ATTEMPTS. A job that cannot succeed (a product ran out, the
+  reservation expired) or used up its attempts is marked `dead` and its order
+  cancelled; dead jobs stay in the table for inspection.
+
+A job whose transaction is lost (worker crash, connection drop) was never marked, so
+its row lock is released and another worker claims it again. When a whole batch fails
+(an error the job savepoints do not contain), the worker backs off and then takes jobs
+one at a time until a batch succeeds: a failure of a single-job batch is charged to
+that job, so a job that breaks every batch it is in still runs out of attempts.
+
+Each worker process also publishes the queue depth and lag (and its own job
+counters) on a Prometheus endpoint at ORDER_WORKER_METRICS_PORT, and purges done
+jobs after ORDER_JOB_RETENTION_HOURS. Run it without PROMETHEUS_MULTIPROC_DIR: every
+worker process is scraped on its own.
+"""
+
+import asyncio
+import os
+import random
+import signal
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple, Union
+
+from prometheus_client import start_http_server
+from pydantic import ValidationError
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import crud, database, models, schemas
+from .catalog import invalidate_cached_product
+from .config import env_float, env_int
+from .metrics.prometheus_exporter import (
+    ORDER_JOB_BATCH_SIZE, ORDER_JOB_LATENCY_SECONDS, ORDER_JOBS_TOTAL, ORDER_QUEUE_DEPTH, ORDER_QUEUE_LAG_SECONDS,
+)
+
+# "sync" processes orders in the request; "queued" records them for the workers
+ORDER_INTAKE_MODE = os.getenv("ORDER_INTAKE_MODE", "sync")
+
+# Jobs claimed and committed together; larger batches mean fewer commits but hold the
+# batch's product locks longer
+ORDER_WORKER_BATCH_SIZE = env_int("ORDER_WORKER_BATCH_SIZE", 20)
+
+# Batches processed concurrently by one worker process (each on its own connection)
+ORDER_WORKER_CONCURRENCY = env_int("ORDER_WORKER_CONCURRENCY", 4)
+
+# Seconds an idle worker waits before looking for due jobs again
+ORDER_WORKER_POLL_INTERVAL_SECONDS = env_float("ORDER_WORKER_POLL_INTERVAL_SECONDS", 0.5)
+
+# Attempts before a job failing on transient errors is given up (marked dead)
+ORDER_JOB_MAX_ATTEMPTS = env_int("ORDER_JOB_MAX_ATTEMPTS", 5)
+
+# Retry backoff: the base delay doubles with every failed attempt, up to the maximum
+ORDER_JOB_RETRY_BASE_SECONDS = env_float("ORDER_JOB_RETRY_BASE_SECONDS", 1.0)
+ORDER_JOB_RETRY_MAX_SECONDS = env_float("ORDER_JOB_RETRY_MAX_SECONDS", 300.0)
+
+# How long done jobs are kept (for the status endpoint) before they are purged
+ORDER_JOB_RETENTION_HOURS = env_float("ORDER_JOB_RETENTION_HOURS", 24.0)
+
+# Seconds between queue depth/lag measurements (and purges) in each worker process
+ORDER_QUEUE_STATS_INTERVAL_SECONDS = env_float("ORDER_QUEUE_STATS_INTERVAL_SECONDS", 15.0)
+
+# Port of the worker's Prometheus endpoint (0 disables)
+ORDER_WORKER_METRICS_PORT = env_int("ORDER_WORKER_METRICS_PORT", 9100)
+
+# Done jobs deleted per purge transaction
+ORDER_JOB_PURGE_BATCH_SIZE = env_int("ORDER_JOB_PURGE_BATCH_SIZE", 1000)
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite returns naive datetimes, which are already in UTC (CURRENT_TIMESTAMP)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff before the next attempt of a job that failed `attempts` times, with jitter."""
+    delay = min(ORDER_JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), ORDER_JOB_RETRY_MAX_SECONDS)
+    # Jobs that failed together (e.g. on a lock timeout) do not all come back at once
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _give_up(job: models.OrderJob, order: models.Order, error: str, now: datetime) -> None:
+    job.state = "dead"
+    job.last_error = error
+    job.finished_at = now
+    order.status = "cancelled"
+
+
+async def _charge_failure(db: AsyncSession, job_id: int, error: str) -> None:
+    """Counts an attempt against a job whose whole transaction failed, in a new transaction."""
+    now = datetime.now(timezone.utc)
+    job = await db.scalar(
+        select(models.OrderJob)
+        .where(models.OrderJob.id == job_id, models.OrderJob.state == "queued")
+        .with_for_update(skip_locked=True)
+    )
+    if job is None:
+        await db.rollback()
+        return
+    job.attempts += 1
+    if job.attempts >= ORDER_JOB_MAX_ATTEMPTS:
+        _give_up(job, await db.get(models.Order, job.order_id), error, now)
+        outcome = "dead"
+    else:
+        job.last_error = error
+        job.run_after = now + timedelta(seconds=retry_delay(job.attempts))
+        outcome = "retry"
+    await db.commit()
+    ORDER_JOBS_TOTAL.labels(outcome=outcome).inc()
+
+
+async def _process_jobs(db: AsyncSession, jobs: List[models.OrderJob], now: datetime) -> None:
+    """Processes claimed jobs, each in its own savepoint, and commits."""
+    Order = models.Order
+    orders = {
+        order.id: order
+        for order in await db.scalars(
+            select(Order).where(Order.id.in_([job.order_id for job in jobs])).options(selectinload(Order.items))
+        )
+    }
+    requests: Dict[int, Union[schemas.OrderCreate, ValidationError]] = {}
+    for job in jobs:
+        try:
+            requests[job.id] = schemas.OrderCreate.model_validate_json(job.payload)
+        except ValidationError as e:
+            requests[job.id] = e # Raised when the job is processed
+    # The batch's reservations are locked before its products, in id order, as a single
+    # checkout taking over its reservation does: the reconciler expiring a reservation
+    # holds its lock while it returns the stock to the products
+    reservation_ids = sorted({
+        request.reservation_id for request in requests.values()
+        if isinstance(request, schemas.OrderCreate) and request.reservation_id is not None
+    })
+    if reservation_ids:
+        await db.execute(
+            select(models.InventoryReservation.id)
+            .where(models.InventoryReservation.id.in_(reservation_ids))
+            .order_by(models.InventoryReservation.id)
+            .with_for_update()
+        )
+    # Every product of the batch is locked up front in id order, as a single checkout
+    # does: locking them job by job could deadlock against another worker's batch
+    product_ids = sorted({item.product_id for order in orders.values() for item in order.items})
+    await db.execute(
+        select(models.Product.id)
+        .where(models.Product.id.in_(product_ids), models.Product.stock_shards == 0)
+        .order_by(models.Product.id)
+        .with_for_update()
+    )
+
+    outcomes: List[Tuple[str, models.Order]] = []
+    changed = set()
+    for job in jobs:
+        order = orders[job.order_id]
+        try:
+            request = requests[job.id]
+            if isinstance(request, ValidationError):
+                raise request
+            async with db.begin_nested():
+                products, touched = await crud.deduct_order_stock(db, request, order.buyer_id)
+                await crud.record_order_sales(db, order, products)
+        except (ValueError, ValidationError) as e:
+            # Out of stock, expired reservation or a malformed payload: retrying cannot help
+            job.attempts += 1
+            _give_up(job, order, str(e), now)
+            outcomes.append(("dead", order))
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts >= ORDER_JOB_MAX_ATTEMPTS:
+                _give_up(job, order, repr(e), now)
+                outcomes.append(("dead", order))
+            else:
+                job.last_error = repr(e)
+                job.run_after = now + timedelta(seconds=retry_delay(job.attempts))
+                outcomes.append(("retry", order))
+        else:
+            job.state = "done"
+            job.finished_at = now
+            order.status = "confirmed" # As an order processed on submission is
+            changed.update(touched)
+            outcomes.append(("done", order))
+    await db.commit()
+
+    # Cached product payloads carry the stock level, which just changed
+    for product_id in changed:
+        invalidate_cached_product(product_id)
+    finished = datetime.now(timezone.utc)
+    ORDER_JOB_BATCH_SIZE.observe(len(jobs))
+    for outcome, order in outcomes:
+        ORDER_JOBS_TOTAL.labels(outcome=outcome).inc()
+        if outcome != "retry" and order.created_at is not None:
+            ORDER_JOB_LATENCY_SECONDS.observe((finished - _utc(order.created_at)).total_seconds())
+
+
+async def process_batch(db: AsyncSession, batch_size: int = ORDER_WORKER_BATCH_SIZE) -> int:
+    """
+    Claims up to `batch_size` due jobs, processes them and commits. Returns the number
+    claimed. If the batch fails as a whole it is rolled back and the error re-raised; a
+    batch of one job is charged the attempt.
+    """
+    Job = models.OrderJob
+    now = datetime.now(timezone.utc)
+    jobs = list((await db.scalars(
+        select(Job)
+        .where(Job.state == "queued", Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all())
+    if not jobs:
+        await db.rollback()
+        return 0
+    job_ids = [job.id for job in jobs]
+    try:
+        await _process_jobs(db, jobs, now)
+    except Exception as e:
+        await db.rollback()
+        # Only a job alone in its batch is known to be the one that failed the transaction
+        if len(job_ids) == 1:
+            await _charge_failure(db, job_ids[0], repr(e))
+        raise
+    return len(jobs)
+
+
+async def queue_stats(db: AsyncSession) -> Tuple[Dict[str, int], float]:
+    """Returns the number of queued and dead jobs, and how long the oldest due job has waited (seconds)."""
+    Job = models.OrderJob
+    depth = {"queued": 0, "dead": 0}
+    depth.update(dict((await db.execute(
+        select(Job.state, func.count()).where(Job.state.in_(list(depth))).group_by(Job.state)
+    )).all()))
+    now = datetime.now(timezone.utc)
+    oldest_due = await db.scalar(select(func.min(Job.run_after)).where(Job.state == "queued", Job.run_after <= now))
+    await db.commit()
+    lag = (now - _utc(oldest_due)).total_seconds() if oldest_due is not None else 0.0
+    return depth, max(lag, 0.0)
+
+
+async def purge_finished(db: AsyncSession, batch_size: int = ORDER_JOB_PURGE_BATCH_SIZE) -> int:
+    """Deletes done jobs older than the retention, in batches. Returns the number deleted."""
+    Job = models.OrderJob
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=ORDER_JOB_RETENTION_HOURS)
+    deleted = 0
+    while True:
+        expired = select(Job.id).where(Job.state == "done", Job.finished_at < cutoff).limit(batch_size)
+        result = await db.execute(delete(Job).where(Job.id.in_(expired)).execution_options(synchronize_session=False))
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+async def _sleep(stop: asyncio.Event, seconds: float) -> None:
+    """Sleeps for `seconds`, or until the worker is asked to stop."""
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def work(stop: asyncio.Event) -> None:
+    """Processes batches until `stop` is set; the batch in progress is finished first."""
+    failures = 0 # Consecutive batches that failed as a whole
+    while not stop.is_set():
+        # After a failed batch jobs are taken one at a time until one succeeds, so a job
+        # that fails every transaction it is in is charged its attempts and given up
+        batch_size = 1 if failures else ORDER_WORKER_BATCH_SIZE
+        try:
+            async with database.AsyncSessionLocal() as db:
+                claimed = await process_batch(db, batch_size)
+        except Exception as e:
+            failures += 1
+            print(f"Order job batch failed ({failures} in a row): {e!r}")
+            # Back off like a failing job, rather than failing again every poll interval
+            await _sleep(stop, retry_delay(failures))
+            continue
+        failures = 0
+        # A full batch suggests more jobs are due
+        if claimed < batch_size:
+            await _sleep(stop, ORDER_WORKER_POLL_INTERVAL_SECONDS)
+
+
+async def monitor(stop: asyncio.Event) -> None:
+    """Publishes the queue depth and lag, and purges done jobs, until `stop` is set."""
+    while not stop.is_set():
+        try:
+            async with database.AsyncSessionLocal() as db:
+                depth, lag = await queue_stats(db)
+                await purge_finished(db)
+            for state, count in depth.items():
+                ORDER_QUEUE_DEPTH.labels(state=state).set(count)
+            ORDER_QUEUE_LAG_SECONDS.set(lag)
+        except Exception as e:
+            print(f"Measuring the order queue failed: {e!r}")
+        await _sleep(stop, ORDER_QUEUE_STATS_INTERVAL_SECONDS)
+
+
+async def main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    if ORDER_WORKER_METRICS_PORT > 0:
+        start_http_server(ORDER_WORKER_METRICS_PORT)
+    print(f"Order worker started ({ORDER_WORKER_CONCURRENCY} concurrent batches of up to {ORDER_WORKER_BATCH_SIZE} jobs).")
+    try:
+        await asyncio.gather(monitor(stop), *(work(stop) for _ in range(ORDER_WORKER_CONCURRENCY)))
+    finally:
+        await database.engine.dispose()
+    print("Order worker stopped.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,225 @@
+# benchmarks/load.py
+#
+# Scripted load against the API, mirroring real traffic: logins, catalog browsing and
+# search, checkouts, buyers listing their orders and admins paging through listings.
+#
+#   python -m benchmarks.load --base-url http://localhost:8000 --concurrency 50 --duration 60 \
+#       --report load.json
+#
+# Against a running server (--base-url) this measures the whole stack, including
+# the workers and the network. With --in-process the app is imported and driven
+# through its ASGI interface instead, on the database in DATABASE_URL (SQLite works
+# as a stand-in):
+#
+#   DATABASE_URL=sqlite+aiosqlite:////tmp/bench.db python -m benchmarks.seed --users 1000 --orders 10000
+#   DATABASE_URL=sqlite+aiosqlite:////tmp/bench.db python -m benchmarks.load --in-process --seeded-users 1000
+#
+# The database must be seeded with `benchmarks.seed`: virtual users log in as its
+# users. Each virtual user runs scenarios back to back, picked at random by weight.
+# Every request is timed under its operation name; failed requests (transport errors
+# and 4xx/5xx responses) are counted as errors. Requests made during --warmup are not
+# recorded. Results are printed and, with --report, written as JSON (see
+# `benchmarks.report` to compare two runs).
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.report import build_report, print_results, summarize, write_report
+from benchmarks.search import ADJECTIVES, NOUNS
+from benchmarks.seed import SEED_PASSWORD, seed_email
+
+# Relative frequency of each scenario
+SCENARIO_WEIGHTS = {
+    "browse": 50,
+    "my_orders": 15,
+    "checkout": 15,
+    "login": 10,
+    "admin": 10,
+}
+
+
+class Recorder:
+    """Collects the latency of successful requests and the number of failed ones, per operation."""
+    def __init__(self, warmup: float):
+        self.record_from = time.perf_counter() + warmup
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        if start >= self.record_from:
+            if response is None or response.status_code >= 400:
+                self.errors[name] += 1
+            else:
+                self.samples[name].append(time.perf_counter() - start)
+        return response
+
+    def results(self, elapsed: float) -> Dict[str, dict]:
+        names = sorted(set(self.samples) | set(self.errors))
+        results = {name: summarize(self.samples[name], elapsed, self.errors[name]) for name in names}
+        results["all"] = summarize(
+            [sample for samples in self.samples.values() for sample in samples], elapsed, sum(self.errors.values())
+        )
+        return results
+
+
+class VirtualUser:
+    """One simulated buyer with its own session; the admin scenario uses the shared admin session."""
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, email: str, rng: random.Random, product_ids: List[int]):
+        self.client = client
+        self.recorder = recorder
+        self.email = email
+        self.rng = rng
+        self.product_ids = product_ids
+        self.headers: Dict[str, str] = {}
+        self.cursor: Optional[str] = None # Where this user's catalog browsing continues
+
+    async def request(self, name: str, method: str, url: str, headers: Optional[dict] = None, **kwargs) -> Optional[httpx.Response]:
+        headers = {**self.headers, **headers} if headers else self.headers
+        return await self.recorder.request(self.client, name, method, url, headers=headers, **kwargs)
+
+    async def login(self) -> None:
+        response = await self.recorder.request(
+            self.client, "login", "POST", "/users/token", data={"username": self.email, "password": SEED_PASSWORD}
+        )
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def browse(self) -> None:
+        params = {"limit": 20}
+        if self.cursor:
+            params["cursor"] = self.cursor
+        response = await self.request("list products", "GET", "/products/", params=params)
+        if response is not None:
+            self.cursor = response.headers.get("X-Next-Cursor") # Starts over after the last page
+        for product_id in self.rng.sample(self.product_ids, min(2, len(self.product_ids))):
+            await self.request("product detail", "GET", f"/products/{product_id}")
+        q = f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)}"
+        await self.request("search products", "GET", "/products/search", params={"q": q})
+
+    async def checkout(self) -> None:
+        items = [
+            {"product_id": product_id, "quantity": self.rng.randint(1, 3)}
+            for product_id in self.rng.sample(self.product_ids, min(self.rng.randint(1, 3), len(self.product_ids)))
+        ]
+        await self.request(
+            "checkout", "POST", "/orders/",
+            json={"shipping_address": "1 Load Test Lane, Benchmark City", "items": items},
+            headers={"Idempotency-Key": str(uuid.uuid4())},
+        )
+
+    async def my_orders(self) -> None:
+        await self.request("my orders", "GET", "/orders/me", params={"limit": 20})
+
+    async def admin(self, admin_headers: Dict[str, str]) -> None:
+        for name, url in (("admin orders", "/orders/"), ("admin order summaries", "/orders/summary"), ("admin users", "/users/")):
+            await self.recorder.request(self.client, name, "GET", url, params={"limit": 50}, headers=admin_headers)
+        await self.recorder.request(self.client, "admin daily revenue", "GET", "/orders/revenue/daily", headers=admin_headers)
+
+
+async def run_user(user: VirtualUser, admin_headers: Dict[str, str], deadline: float, think_time: float) -> None:
+    scenarios, weights = list(SCENARIO_WEIGHTS), list(SCENARIO_WEIGHTS.values())
+    await user.login()
+    while time.perf_counter() < deadline:
+        scenario = user.rng.choices(scenarios, weights)[0]
+        if scenario == "admin":
+            await user.admin(admin_headers)
+        else:
+            await getattr(user, scenario)()
+        if think_time:
+            await asyncio.sleep(user.rng.uniform(0, 2 * think_time))
+
+
+async def login_admin(client: httpx.AsyncClient, email: str) -> Dict[str, str]:
+    response = await client.post("/users/token", data={"username": email, "password": SEED_PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def catalog_sample(client: httpx.AsyncClient, headers: Dict[str, str], size: int) -> List[int]:
+    """IDs of the first `size` products, which the virtual users view and buy."""
+    product_ids: List[int] = []
+    params = {"limit": 100}
+    while len(product_ids) < size:
+        response = await client.get("/products/", params=params, headers=headers)
+        response.raise_for_status()
+        product_ids.extend(product["id"] for product in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params["cursor"] = cursor
+    if not product_ids:
+        raise SystemExit("The catalog is empty; seed it with benchmarks.seed first")
+    return product_ids[:size]
+
+
+async def run(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict[str, dict]:
+    admin_headers = await login_admin(client, seed_email(args.first_user_id))
+    product_ids = await catalog_sample(client, admin_headers, args.catalog_sample)
+
+    recorder = Recorder(args.warmup)
+    rng = random.Random(args.random_seed)
+    users = [
+        VirtualUser(
+            client, recorder, seed_email(args.first_user_id + rng.randrange(args.seeded_users)),
+            random.Random(rng.random()), product_ids,
+        )
+        for _ in range(args.concurrency)
+    ]
+    deadline = recorder.record_from + args.duration
+    await asyncio.gather(*(run_user(user, admin_headers, deadline, args.think_time) for user in users))
+    # Scenarios running at the deadline finish, so the recording ends a little after it
+    return recorder.results(time.perf_counter() - recorder.record_from)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Scripted API load test")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-url", help="URL of a running server")
+    target.add_argument("--in-process", action="store_true", help="drive the app in this process (uses DATABASE_URL)")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to record for")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds to run before recording")
+    parser.add_argument("--think-time", type=float, default=0.0, help="average pause between scenarios in seconds")
+    parser.add_argument("--first-user-id", type=int, default=1, help="ID of the first seeded user (the admin)")
+    parser.add_argument("--seeded-users", type=int, default=1000, help="seeded users the virtual users log in as")
+    parser.add_argument("--catalog-sample", type=int, default=500, help="products the virtual users view and buy")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--report", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    database_url = None
+    timeout = httpx.Timeout(60.0)
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    if args.in_process:
+        from app.database import DATABASE_URL
+        from app.main import app
+
+        database_url = DATABASE_URL
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+                results = await run(client, args)
+    else:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+            results = await run(client, args)
+
+    print_results(results)
+    if args.report:
+        params = {key: value for key, value in vars(args).items() if key != "report"}
+        write_report(build_report("load", database_url, params, results), args.report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+# benchmarks/middleware.py
+#
+# Measures the per-request overhead of the Prometheus middleware by driving the ASGI
+# app directly (no sockets, no database):
+#
+#   python -m benchmarks.middleware --requests 20000
+#
+# Three stacks are compared on an app with as many routes as the real one:
+# no middleware, the previous BaseHTTPMiddleware implementation (kept here as a
+# reference) and the current pure ASGI PrometheusMiddleware.
+
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.routing import Match
+
+from app.metrics.middleware import PrometheusMiddleware
+from app.metrics.prometheus_exporter import REQUESTS_TOTAL, REQUEST_DURATION_SECONDS
+
+
+class LegacyPrometheusMiddleware(BaseHTTPMiddleware):
+    """The BaseHTTPMiddleware version this benchmark is compared against."""
+    async def dispatch(self, request: Request, call_next):
+        method = request.method
+        path_template = request.url.path
+        for route in request.app.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                path_template = route.path
+                break
+        start_time = time.time()
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        REQUESTS_TOTAL.labels(method=method, path=path_template, status_code=response.status_code).inc()
+        REQUEST_DURATION_SECONDS.labels(method=method, path=path_template).observe(process_time)
+        return response
+
+
+def build_app(middleware=None, routes: int = 30) -> FastAPI:
+    """A FastAPI app with `routes` parameterized endpoints; the last one is requested."""
+    app = FastAPI()
+    for index in range(routes):
+        async def endpoint(item_id: int):
+            return {"item_id": item_id}
+        app.add_api_route(f"/resource{index}/{{item_id}}", endpoint, methods=["GET"])
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+
+async def drive(app, path: str, requests: int) -> float:
+    """Sends `requests` GET requests straight into the ASGI app; returns µs per request."""
+    async def send(message):
+        pass
+
+    def make_receive():
+        # The request body is delivered once; later calls wait for a disconnect
+        # that never comes, like a client that keeps the connection open.
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()
+
+        return receive
+
+    def scope():
+        return {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 1234),
+            "server": ("bench", 80),
+        }
+
+    for _ in range(200):  # warm-up
+        await app(scope(), make_receive(), send)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(scope(), make_receive(), send)
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Prometheus middleware overhead")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--routes", type=int, default=30)
+    args = parser.parse_args()
+
+    path = f"/resource{args.routes - 1}/42"
+    stacks = {
+        "no middleware": build_app(None, args.routes),
+        "BaseHTTPMiddleware (legacy)": build_app(LegacyPrometheusMiddleware, args.routes),
+        "pure ASGI (current)": build_app(PrometheusMiddleware, args.routes),
+    }
+    results = {name: await drive(app, path, args.requests) for name, app in stacks.items()}
+    baseline = results["no middleware"]
+    print(f"{'stack':<30} {'µs/request':>12} {'overhead µs':>12}")
+    for name, value in results.items():
+        print(f"{name:<30} {value:>12.1f} {value - baseline:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
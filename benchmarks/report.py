@@ -0,0 +1,120 @@
+# benchmarks/report.py
+#
+# Latency and throughput summaries shared by `benchmarks.load` and `benchmarks.micro`,
+# written as JSON so runs can be compared across commits. Comparing two reports:
+#
+#   python -m benchmarks.report before.json after.json
+#
+# A report records the git commit, the database backend and the run's parameters
+# next to one summary per scenario or function: count, errors, throughput and the
+# mean, p50, p95, p99 and max latency in milliseconds.
+
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import orjson
+from sqlalchemy.engine import make_url
+
+
+def summarize(samples: List[float], elapsed: float, errors: int = 0) -> dict:
+    """Summarizes latency samples (seconds) collected over `elapsed` seconds."""
+    ms = sorted(sample * 1000 for sample in samples)
+    if len(ms) >= 2:
+        cuts = statistics.quantiles(ms, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ms[0] if ms else 0.0
+    return {
+        "count": len(ms),
+        "errors": errors,
+        "throughput": len(ms) / elapsed if elapsed > 0 else 0.0, # Per second
+        "mean_ms": statistics.fmean(ms) if ms else 0.0,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": ms[-1] if ms else 0.0,
+    }
+
+
+def git_revision() -> Optional[str]:
+    """The commit being benchmarked (with "-dirty" for uncommitted changes), if known."""
+    try:
+        revision = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return revision or None
+
+
+def build_report(benchmark: str, database_url: Optional[str], params: dict, results: Dict[str, dict]) -> dict:
+    """Assembles a report; the database is identified by backend and name only (no credentials)."""
+    database = None
+    if database_url:
+        url = make_url(database_url)
+        database = {"backend": url.get_backend_name(), "host": url.host, "name": url.database}
+    return {
+        "benchmark": benchmark,
+        "commit": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": database,
+        "params": params,
+        "results": results,
+    }
+
+
+def write_report(report: dict, path: str) -> None:
+    with open(path, "wb") as output:
+        output.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    print(f"Report written to {path}")
+
+
+def load_report(path: str) -> dict:
+    with open(path, "rb") as report:
+        return orjson.loads(report.read())
+
+
+def print_results(results: Dict[str, dict]) -> None:
+    print(f"{'name':<32} {'count':>8} {'errors':>7} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<32} {result['count']:>8} {result['errors']:>7} {result['throughput']:>9.1f} "
+            f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['max_ms']:>9.2f}"
+        )
+
+
+def _change(before: float, after: float) -> str:
+    return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+
+
+def compare(before: dict, after: dict) -> None:
+    """Prints the change of throughput and percentiles for the names both reports contain."""
+    print(f"before: {before.get('commit')} ({before['created_at']}), after: {after.get('commit')} ({after['created_at']})")
+    if before.get("params") != after.get("params"):
+        print("note: the runs used different parameters")
+    print(f"{'name':<32} {'per s':>10} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for name, old in before["results"].items():
+        new = after["results"].get(name)
+        if new is None:
+            continue
+        print(
+            f"{name:<32} {_change(old['throughput'], new['throughput']):>10} {_change(old['p50_ms'], new['p50_ms']):>10} "
+            f"{_change(old['p95_ms'], new['p95_ms']):>10} {_change(old['p99_ms'], new['p99_ms']):>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    compare(load_report(args.before), load_report(args.after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# benchmarks/serialization.py
+#
+# Measures the throughput of `GET /orders/` for a page of large orders, driving the
+# ASGI app directly (no sockets, no database: the order queries return prebuilt ORM
+# objects or rows):
+#
+#   python -m benchmarks.serialization --orders 100 --items-per-order 20
+#
+# Four serialization paths are compared on the same data:
+# - ORM objects returned through `response_model` and the stdlib JSONResponse (before);
+# - the same with ORJSONResponse as the default response class;
+# - ORM objects through TypeAdapter.dump_json into a pre-encoded Response;
+# - the orders router as it is now (column rows encoded by orjson, no revalidation).
+
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy.engine.result import result_tuple
+
+from app import models, schemas
+from app.auth import get_current_admin_user
+from app.database import get_db
+from app.queries import orders as order_queries
+from app.routers import orders as orders_router
+from app.serialization import json_response
+from benchmarks.middleware import drive
+
+
+def build_orders(orders: int, items_per_order: int) -> List[models.Order]:
+    """Builds detached ORM orders with their items, as the order query would return them."""
+    now = datetime(2024, 1, 1)
+    result = []
+    for order_id in range(orders, 0, -1):
+        created_at = now + timedelta(minutes=order_id)
+        order = models.Order(
+            id=order_id,
+            buyer_id=1,
+            total_amount=10.0 * items_per_order,
+            status="pending",
+            shipping_address="1 Benchmark Street, Testville",
+            created_at=created_at,
+            updated_at=None,
+        )
+        order.items = [
+            models.OrderItem(
+                id=order_id * items_per_order + index,
+                order_id=order_id,
+                product_id=index + 1,
+                quantity=1,
+                price_at_purchase=10.0,
+                created_at=created_at,
+            )
+            for index in range(items_per_order)
+        ]
+        result.append(order)
+    return result
+
+
+def as_rows(page: List[models.Order]) -> List[order_queries.OrderRow]:
+    """Converts ORM orders into the rows the column-projected order query returns."""
+    order_keys = [column.key for column in order_queries.ORDER_COLUMNS]
+    item_keys = [column.key for column in order_queries.ORDER_ITEM_COLUMNS]
+    make_order = result_tuple(order_keys)
+    rows = []
+    for order in page:
+        row = make_order([getattr(order, key) for key in order_keys])
+        items = [{key: getattr(item, key) for key in item_keys} for item in order.items]
+        rows.append(order_queries.OrderRow(**row._mapping, items=items))
+    return rows
+
+
+async def _no_db():
+    yield None
+
+
+async def _admin():
+    return schemas.UserResponse(
+        id=1, email="admin@example.com", is_active=True, is_admin=True, created_at=datetime(2024, 1, 1)
+    )
+
+
+def build_app(mode: str) -> FastAPI:
+    """An app serving GET /orders/ with the given serialization path."""
+    if mode == "current":
+        app = FastAPI(default_response_class=ORJSONResponse)
+        app.include_router(orders_router.router)
+    elif mode == "adapter":
+        app = FastAPI(default_response_class=ORJSONResponse)
+
+        @app.get("/orders/", response_model=List[schemas.OrderResponse])
+        async def read_all_orders(skip: int = 0, limit: int = 100, db=Depends(get_db), user=Depends(get_current_admin_user)):
+            orders = await order_queries.list_orders(db, skip=skip, limit=limit)
+            return json_response(List[schemas.OrderResponse], orders)
+    else:
+        response_class = ORJSONResponse if mode == "orjson" else JSONResponse
+        app = FastAPI(default_response_class=response_class)
+
+        @app.get("/orders/", response_model=List[schemas.OrderResponse])
+        async def read_all_orders(skip: int = 0, limit: int = 100, db=Depends(get_db), user=Depends(get_current_admin_user)):
+            return await order_queries.list_orders(db, skip=skip, limit=limit)
+
+    app.dependency_overrides[get_db] = _no_db
+    app.dependency_overrides[get_current_admin_user] = _admin
+    return app
+
+
+async def fetch_body(app, path: str) -> bytes:
+    """Performs one GET request against the ASGI app and returns the response body."""
+    body = bytearray()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.extend(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    return bytes(body)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="GET /orders/ serialization throughput")
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--items-per-order", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    page = build_orders(args.orders, args.items_per_order)
+    rows = as_rows(page)
+
+    async def list_orders(db, buyer_id=None, skip=0, limit=100, cursor=None, include_items=True):
+        return page
+
+    async def list_order_rows(db, buyer_id=None, skip=0, limit=100, cursor=None, include_items=True):
+        return rows
+
+    # The query layer is replaced for every app (the router looks it up at call time)
+    order_queries.list_orders = list_orders
+    order_queries.list_order_rows = list_order_rows
+
+    stacks = {
+        "response_model + JSONResponse (before)": build_app("stdlib"),
+        "response_model + ORJSONResponse": build_app("orjson"),
+        "TypeAdapter.dump_json": build_app("adapter"),
+        "column rows + orjson (current)": build_app("current"),
+    }
+    bodies = {name: await fetch_body(app, "/orders/") for name, app in stacks.items()}
+    reference = json.loads(next(iter(bodies.values())))
+    for name, body in bodies.items():
+        assert json.loads(body) == reference, f"{name} returned a different payload"
+
+    print(f"{args.orders} orders x {args.items_per_order} items, {len(next(iter(bodies.values()))) / 1024:.0f} KiB per response")
+    print(f"{'path':<40} {'ms/request':>11} {'requests/s':>11}")
+    baseline = None
+    for name, app in stacks.items():
+        micros = await drive(app, "/orders/", args.requests)
+        baseline = baseline or micros
+        print(f"{name:<40} {micros / 1000:>11.2f} {1_000_000 / micros:>11.0f}  ({baseline / micros:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
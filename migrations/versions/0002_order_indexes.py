@@ -0,0 +1,44 @@
+"""Foreign-key, pagination and status indexes on orders and order items
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:30:00
+
+The indexes are built with CREATE INDEX CONCURRENTLY so they can be applied to a
+live database without blocking writes. CONCURRENTLY cannot run inside a
+transaction, hence the autocommit block; IF NOT EXISTS makes a rerun after an
+interrupted build safe (drop any index left INVALID before retrying).
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ("ix_orders_buyer_id_created_at_id", "orders", [sa.text("buyer_id"), sa.text("created_at DESC"), sa.text("id DESC")]),
+    ("ix_orders_created_at_id", "orders", [sa.text("created_at DESC"), sa.text("id DESC")]),
+    ("ix_orders_status_created_at", "orders", [sa.text("status"), sa.text("created_at DESC")]),
+    ("ix_order_items_order_id", "order_items", ["order_id"]),
+    ("ix_order_items_product_id", "order_items", ["product_id"]),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
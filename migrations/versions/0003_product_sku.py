@@ -0,0 +1,38 @@
+"""Product SKU column with a unique index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:00:00
+
+Adds the nullable `products.sku` column that bulk imports upsert on. Adding a
+nullable column without a default only touches the catalog, so it does not rewrite
+the table; the unique index is built CONCURRENTLY (outside a transaction) so writes
+are not blocked meanwhile. Existing products keep a NULL SKU, which the unique
+index allows any number of times.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("products", sa.Column("sku", sa.String(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_sku", "products", ["sku"], unique=True, postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_products_sku", table_name="products", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("products", "sku")
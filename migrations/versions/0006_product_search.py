@@ -0,0 +1,58 @@
+"""Full-text and trigram search indexes on products
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 17:00:00
+
+Adds a GIN expression index on the products' full-text document (name with weight
+A, description with weight B) and a pg_trgm GIN index on the name for
+typo-tolerant search. The document is not stored in a column: adding a stored
+generated column would rewrite `products` under an exclusive lock, blocking
+catalog reads and checkouts, whereas both indexes are built CONCURRENTLY without
+blocking writes. Searches use the same expression (see `queries.products`).
+Creating the pg_trgm extension requires the CREATE privilege on the database.
+
+Nothing changes on SQLite (local use only), which searches by substring.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Must stay identical to `models.PRODUCT_SEARCH_DOCUMENT` for searches to use the index
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_search_document", "products", [sa.text(f"({SEARCH_DOCUMENT})")], # An expression that is not a function call needs its own parentheses
+            postgresql_using="gin", postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_products_name_trgm", "products", ["name"],
+            postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}, postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_products_name_trgm", table_name="products", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_products_search_document", table_name="products", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,96 @@
+"""Inventory shards and stock reservations
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 19:00:00
+
+Adds `products.stock_shards` and the `inventory_shards` table holding the stock of
+sharded products, plus `inventory_reservations` and their items for stock held
+ahead of an order. Products start unsharded, so nothing changes until an admin
+shards one.
+
+`product_sales_stats` gets a `bucket` column, and its primary key becomes
+(product_id, bucket); existing rows are bucket 0. Replacing the primary key
+rebuilds its index under an exclusive lock, which is brief on a table with one
+row per product.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _replace_sales_primary_key(columns: Sequence[str]) -> None:
+    # SQLite cannot alter a primary key, so the batch recreates the table there
+    with op.batch_alter_table("product_sales_stats") as batch_op:
+        if op.get_bind().dialect.name == "postgresql":
+            batch_op.drop_constraint("product_sales_stats_pkey", type_="primary")
+        batch_op.create_primary_key("product_sales_stats_pkey", list(columns))
+
+
+def upgrade() -> None:
+    op.add_column("products", sa.Column("stock_shards", sa.SmallInteger(), server_default="0", nullable=False))
+    op.create_table(
+        "inventory_shards",
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("shard", sa.SmallInteger(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.CheckConstraint("quantity >= 0", name="ck_inventory_shards_quantity"),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("product_id", "shard"),
+    )
+    op.create_table(
+        "inventory_reservations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("buyer_id", sa.Integer(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(["buyer_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_inventory_reservations_expires_at", "inventory_reservations", ["expires_at"])
+    op.create_table(
+        "inventory_reservation_items",
+        sa.Column("reservation_id", sa.Integer(), nullable=False),
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["reservation_id"], ["inventory_reservations.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("reservation_id", "product_id"),
+    )
+
+    op.add_column("product_sales_stats", sa.Column("bucket", sa.SmallInteger(), server_default="0", nullable=False))
+    _replace_sales_primary_key(["product_id", "bucket"])
+
+
+def downgrade() -> None:
+    # Fold each product's buckets into its lowest one before dropping the column
+    op.execute(
+        "UPDATE product_sales_stats SET "
+        "units_sold = (SELECT sum(s.units_sold) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id), "
+        "order_count = (SELECT sum(s.order_count) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id), "
+        "revenue = (SELECT sum(s.revenue) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id), "
+        "cost = (SELECT sum(s.cost) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id), "
+        "last_sold_at = (SELECT max(s.last_sold_at) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id) "
+        "WHERE bucket = (SELECT min(s.bucket) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id)"
+    )
+    op.execute(
+        "DELETE FROM product_sales_stats "
+        "WHERE bucket > (SELECT min(s.bucket) FROM product_sales_stats s WHERE s.product_id = product_sales_stats.product_id)"
+    )
+    _replace_sales_primary_key(["product_id"])
+    op.drop_column("product_sales_stats", "bucket")
+
+    op.drop_table("inventory_reservation_items")
+    op.drop_index("ix_inventory_reservations_expires_at", table_name="inventory_reservations")
+    op.drop_table("inventory_reservations")
+    op.drop_table("inventory_shards")
+    op.drop_column("products", "stock_shards")